@@ -1,177 +1,2774 @@
-from collections import deque
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+import argparse
+import hashlib
+import marshal
+import math
+import mmap
+import multiprocessing
+import operator
+import os
+import random
 import re
+import struct
 import sys
+import threading
+
+try: # Optional; only needed by the "vectorized" and "affine" engines
+    import numpy
+except ImportError:
+    numpy = None
 
 '''
 Class [SpreadsheetEval] evaluates a single comma-delimited spreadsheet and writes output to a specified output file.
 Handles basic arithmetic operations (according to post-order notation), references to other cells, and errors.
 
-Usage is as follows:
-    python3 SpreadsheetEvaluator.py <inputfile> <outputfile>
+Usage is as follows:
+    python3 SpreadsheetEvaluator.py <inputfile> <outputfile> [--engine ENGINE] [--workers N] [--parallel-parse]
+        [--iterate] [--max-iterations N] [--max-change X] [--cells CELLS] [--save-snapshot FILE] [--from-snapshot]
+        [--plan-cache DIR]
+
+Input file is a plaintext representation of a single spreadsheet with no more than 500,000 cells (empty or non-empty)
+Output file is a similar plaintext file with the evaluated results for each cell; cells that could not be evaluated
+    hold an error value (#DIV/0!, #REF!, #CYCLE!, #PARSE! or #VALUE!) and the rest of the sheet is still evaluated
+'''
+
+# Per-cell states; any state past VISITING means the cell's value is known
+UNVISITED = 0
+VISITING = 1
+NUMBER = 2 # Value is stored in the value buffer
+EMPTY = 3 # Empty cell, or an expression that evaluated to an empty cell
+
+# Error states; every state from ERROR_DIV0 on is an error
+ERROR_DIV0 = 4 # Division by zero
+ERROR_REF = 5 # Reference to a cell outside the grid
+ERROR_CYCLE = 6 # Part of (or depends on) a circular reference
+ERROR_PARSE = 7 # Expression could not be compiled
+ERROR_VALUE = 8 # Empty cell used as an arithmetic operand
+
+ERROR_TEXT = {
+    ERROR_DIV0: "#DIV/0!",
+    ERROR_REF: "#REF!",
+    ERROR_CYCLE: "#CYCLE!",
+    ERROR_PARSE: "#PARSE!",
+    ERROR_VALUE: "#VALUE!",
+}
+
+# Bytecode instructions produced by compileExpression; every instruction has one operand
+PUSH_CONST = 0 # Operand is an index into the constant pool
+PUSH_REF = 1 # Operand is the referenced cell ID
+ADD = 2
+SUB = 3
+MUL = 4
+DIV = 5
+
+OPERATORS = {"+": ADD, "-": SUB, "*": MUL, "/": DIV}
+BYTE_OPERATORS = {op.encode(): opcode for op, opcode in OPERATORS.items()}
+
+NUMBER_PATTERN = re.compile(r"[+-]?\d*(\.\d+)?")
+
+# Classifies a token of the input file as bytes: a cell reference (column letters and row digits),
+# an operator or a number, as told by match.lastindex (2, 3 or 4)
+TOKEN_PATTERN = re.compile(rb"([A-Z]+)([0-9]+)|([-+*/])|([+-]?(?:[0-9]+(?:\.[0-9]+)?|\.[0-9]+))")
+
+# Bytes that str methods treat differently from bytes methods (non-ASCII, and separators \x1c-\x1f, which
+# str.split() treats as whitespace); rows containing any are decoded and compiled as text
+TEXT_ONLY_BYTES = re.compile(rb"[\x1c-\x1f\x80-\xff]")
+
+# Python source for each arithmetic opcode, used by the code generation engine
+OPERATOR_SOURCE = {ADD: "+", SUB: "-", MUL: "*", DIV: "/"}
+
+# Max number of cells per generated function, keeping each function well within the compiler's limits
+CODEGEN_CHUNK_SIZE = 1000
+
+# Cell ID given to references that point outside of the spreadsheet grid
+OUT_OF_GRID = -1
+
+# Max number of error messages printed by main; every error value is still written to the output file
+MAX_REPORTED_ERRORS = 20
+
+# Max number of cells named in the error message of a single circular reference
+MAX_CYCLE_MEMBERS = 10
+
+# Compiled-sheet snapshot files (see saveSnapshot) start with SNAPSHOT_HEADER (magic, version, section count),
+# followed by the item count of each section and then the sections themselves, in this order, each padded to 8 bytes
+SNAPSHOT_MAGIC = b"SSEVSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<8sII")
+SNAPSHOT_SECTIONS = [
+    ("rowStart", 'q'), ("codeStart", 'q'), ("codeEnd", 'q'), ("opcodes", 'B'), ("operands", 'q'), ("constants", 'd'),
+    ("values", 'd'), ("cellState", 'B'), ("precedentStart", 'q'), ("precedentIds", 'q'), ("dependentStart", 'q'),
+    ("dependentIds", 'q'), ("topoOrder", 'q'), ("errorCells", 'q'), ("errorLengths", 'q'), ("errorText", 'B'),
+]
+
+# Parts of the evaluation plan kept in the plan cache (see storePlan); none of them depend on the constants' values
+PLAN_ATTRIBUTES = ["precedents", "dependents", "topoOrder", "levels", "components", "templateGroups", "generatedCode"]
+
+# Number of plans kept in memory by the plan cache; the least recently used plan is evicted first
+PLAN_CACHE_SIZE = 8
+
+# Evaluation engines accepted by SpreadsheetEval.engine (see SpreadsheetEval.evaluate)
+ENGINES = ["iterative", "recursive", "topological", "codegen", "parallel", "sharded", "threaded", "subinterpreters", "vectorized", "shared", "affine", "linear"]
+
+# Engines that evaluate cell by cell straight from the compiled code, building no plan that the plan cache could keep
+CELL_ENGINES = ["iterative", "recursive"]
+
+# Number of tasks per worker the "sharded" engine aims for when packing components, leaving room to balance load
+TASKS_PER_WORKER = 4
+
+# Number of locks guarding the precedent counters of the "threaded" engine; cells share locks by ID
+COUNTER_LOCKS = 64
+
+# Seconds an idle thread of the "threaded" engine waits before looking for work to steal again
+STEAL_BACKOFF = 0.0001
+
+# Template groups with fewer cells than this are evaluated cell by cell by the "vectorized" engine,
+# since a NumPy operation only pays off over many cells
+MIN_TEMPLATE_GROUP_SIZE = 32
+
+# Source run in each worker interpreter of the "subinterpreters" engine to import this module and set up its
+# sheet view; the buffers it reads are bound into the interpreter's __main__ beforehand
+SUBINTERPRETER_SETUP = '''
+import sys
+sys.path.insert(0, {directory!r})
+import {module} as spreadsheetModule
+spreadsheetModule.initParallelWorker(values, state, codeStart, codeEnd, opcodes, operands, constants)
+'''
+
+# Sheet view used by each worker process (or interpreter) of the parallel engines; set up by initParallelWorker
+workerSheet = None
+
+'''
+Sets up a worker process of the "parallel" and "sharded" engines, or a worker interpreter of the "subinterpreters" engine
+
+The value buffer and cell states live in shared memory (or are shared as memoryviews between interpreters),
+    so values are never pickled. The compiled code is only sent once, when the worker starts
+'''
+def initParallelWorker(sharedValues, sharedState, codeStart, codeEnd, opcodes, operands, constants):
+    global workerSheet
+    workerSheet = SpreadsheetEval(None, None)
+    workerSheet.values = memoryview(sharedValues).cast('B').cast('d')
+    workerSheet.cellState = memoryview(sharedState).cast('B')
+    workerSheet.codeStart = codeStart
+    workerSheet.codeEnd = codeEnd
+    workerSheet.opcodes = opcodes
+    workerSheet.operands = operands
+    workerSheet.constants = constants
+
+'''
+Evaluates a batch of cells in the given order in a worker process, writing results to shared memory
+'''
+def evaluateParallelBatch(cellIds):
+    for cellId in cellIds:
+        workerSheet.setValue(cellId, workerSheet.evaluateExpression(cellId))
+
+# Byte offset of each row of the input file, used by parsing workers; set up by initParseWorker
+workerRowOffsets = None
+
+'''
+Sets up a worker process for parallel parsing (see SpreadsheetEval.parseParallel) with the row index of the input file
+'''
+def initParseWorker(inputFile, rowStart, rowOffsets, maxTokensPerCell):
+    global workerSheet, workerRowOffsets
+    workerSheet = SpreadsheetEval(inputFile, None)
+    workerSheet.maxTokensPerCell = maxTokensPerCell
+    workerSheet.rowStart = rowStart
+    cellCount = rowStart[-1]
+    workerSheet.values = array('d', bytes(8 * cellCount))
+    workerSheet.cellState = bytearray(cellCount)
+    workerSheet.codeStart = array('q', bytes(8 * cellCount))
+    workerSheet.codeEnd = array('q', bytes(8 * cellCount))
+    workerRowOffsets = rowOffsets
+
+'''
+Compiles a range of rows [firstRow, lastRow) in a worker process
+
+Returns the compiled range as compact arrays: values, cell states and code ranges of its cells, and its own
+    instruction stream, constant pool (which the code ranges and PUSH_CONST operands index from 0) and error messages
+'''
+def parseRowRange(rowRange):
+    firstRow, lastRow = rowRange
+    sheet = workerSheet
+    sheet.opcodes = bytearray()
+    sheet.operands = array('q')
+    sheet.constants = array('d')
+    sheet.errorMessages = {}
+    sheet.expressionIndex = {}
+    sheet.byteExpressionIndex = {}
+    with open(sheet.inputFile, 'rb') as file, sheet.mapInput(file) as data:
+        sheet.compileRows(data, workerRowOffsets, firstRow, lastRow)
+
+    first = sheet.rowStart[firstRow]
+    last = sheet.rowStart[lastRow]
+    return (sheet.values[first:last], sheet.cellState[first:last], sheet.codeStart[first:last], sheet.codeEnd[first:last],
+        sheet.opcodes, sheet.operands, sheet.constants, sheet.errorMessages)
+
+# In-memory plan cache shared by all sheets of this process: maps a structure hash (key, see getStructureHash) to
+# the marshalled evaluation plan (value), least recently used first
+cachedPlans = OrderedDict()
+
+'''
+Error value of a cell, used as an operand in place of a float
+
+Arithmetic with an error value gives back that same error value, so errors propagate to dependents
+    through plain operators, with no checks or exceptions in the evaluation loops
+'''
+class CellError:
+    __slots__ = ("state",)
+
+    def __init__(self, state):
+        self.state = state
+
+    def __str__(self):
+        return ERROR_TEXT[self.state]
+
+    def propagate(self, other):
+        return self
+
+    __add__ = __radd__ = __sub__ = __rsub__ = propagate
+    __mul__ = __rmul__ = __truediv__ = __rtruediv__ = propagate
+
+'''
+Operand used for a reference to an empty cell
+
+An empty cell may be referenced on its own (the referencing cell is then empty too), but arithmetic with it
+    gives #VALUE! - unless the other operand is already an error value, which takes precedence
+'''
+class EmptyOperand:
+    __slots__ = ()
+
+    state = EMPTY
+
+    def combine(self, other):
+        return other if isinstance(other, CellError) else ERROR_VALUES[ERROR_VALUE]
+
+    __add__ = __radd__ = __sub__ = __rsub__ = combine
+    __mul__ = __rmul__ = __truediv__ = __rtruediv__ = combine
+
+'''
+Read-only view of one side of the dependency graph kept in CSR form, as loaded from a snapshot (see
+    SpreadsheetEval.loadSnapshot): maps cell ID (key) to the list of cell IDs at ids[starts[cell]:starts[cell + 1]]
+    (value), for every cell flagged in hasEntry
+
+Lists are only built for the cells looked up, so loading a snapshot never turns the whole graph into Python objects
+'''
+class CompressedGraph(Mapping):
+    def __init__(self, starts, ids, hasEntry):
+        self.starts = starts
+        self.ids = ids
+        # Whether each cell (by ID) is a key, which it can be with an empty list
+        self.hasEntry = hasEntry
+        # The keys in order, listed on first iteration
+        self.cells = None
+
+    def __getitem__(self, cell):
+        if not 0 <= cell < len(self.hasEntry) or not self.hasEntry[cell]:
+            raise KeyError(cell)
+        return self.ids[self.starts[cell]:self.starts[cell + 1]].tolist()
+
+    def __iter__(self):
+        if self.cells is None:
+            self.cells = [cell for cell, entry in enumerate(self.hasEntry) if entry]
+        return iter(self.cells)
+
+    def __len__(self):
+        return self.hasEntry.count(1)
+
+ERROR_VALUES = {state: CellError(state) for state in ERROR_TEXT}
+EMPTY_OPERAND = EmptyOperand()
+
+# Operand for a reference to a cell in each state (indexed by state); NUMBER cells are read from the value buffer
+STATE_OPERANDS = [None, None, None, EMPTY_OPERAND] + [ERROR_VALUES[state] for state in sorted(ERROR_TEXT)]
+
+class SpreadsheetEval:
+    def __init__(self, inputFile, outputFile):
+        # Hard cap on max tokens per expression to ensure run-time efficiency that reduces to O(N), where N is number of cells
+        self.maxTokensPerCell = 100
+
+        # Cap on number of cells in input file; given in problem statement
+        self.maxCells = 500000
+
+        # Plaintext input file given as cmd param
+        self.inputFile = inputFile
+
+        # Output file given as cmd param
+        self.outputFile = outputFile
+
+        # Cells are identified by dense integer IDs, numbered row by row from 0
+        # rowStart[r] is the ID of the first cell in row r; rowStart[-1] is the total number of cells
+        self.rowStart = array('q', [0])
+
+        # Compiled expressions of all cells, stored as one flat instruction stream (opcodes and operands)
+        # Cell i's instructions are at [codeStart[i], codeEnd[i]); the range is empty for cells with nothing to evaluate
+        self.codeStart = array('q')
+        self.codeEnd = array('q')
+        self.opcodes = bytearray()
+        self.operands = array('q')
+
+        # Constant pool of numeric literals, referenced by PUSH_CONST
+        self.constants = array('d')
+
+        # Maps an expression's tokens, joined by spaces (key), to the code range compiled for it (value),
+        # so cells with identical expressions share one copy of the code
+        self.expressionIndex = {}
+
+        # The same for expressions compiled straight from bytes (see compileCellBytes), keyed by their tokens as bytes
+        self.byteExpressionIndex = {}
+
+        # Maps column letters as bytes (key) to the column index (value), for references met while parsing
+        self.columnIndexes = {}
+
+        # Evaluated result of each cell as a float, indexed by cell ID; only meaningful for cells in the NUMBER state
+        self.values = array('d')
+
+        # State (UNVISITED, VISITING, NUMBER, EMPTY or an error state) of each cell, indexed by cell ID
+        self.cellState = bytearray()
+
+        # Maps cell ID (key) to a message describing its error (value), for errors whose cause is only known
+        # while parsing or evaluating (parse errors and circular references); see getErrors()
+        self.errorMessages = {}
+
+        # Evaluation engine used by evaluate(); see evaluate() for available engines
+        self.engine = "iterative"
+
+        # Dependency graph, built once after parsing by buildDependencyGraph()
+        # Maps cell ID (key) to the non-empty cells its expression references (value)
+        self.precedents = {}
+
+        # Maps cell ID (key) to the cells whose expressions reference it (value); kept up to date by setCell()
+        self.dependents = None
+
+        # Cells changed by setCell() since the last recalculate()
+        self.changedCells = set()
+
+        # All non-empty cells in topological order (precedents before dependents)
+        self.topoOrder = None
+
+        # Code object generated from the whole sheet by generateCode(), and the functions it defines,
+        # run in order by the "codegen" engine
+        self.generatedCode = None
+        self.generatedChunks = None
+
+        # Topological levels of the sheet; every cell's precedents are in earlier levels. Built by buildLevels()
+        self.levels = None
+
+        # Weakly connected components of the dependency graph, each in topological order. Built by buildComponents()
+        self.components = None
+
+        # Per topological level, the level's cells grouped by formula template (see buildTemplates)
+        self.templateGroups = None
+
+        # Expression DAG with one node per distinct (opcode, operand, operand) tuple across the sheet, and the root
+        # node of each formula cell. Built by buildExpressionNodes()
+        self.nodeOpcodes = None
+        self.nodeOperands = None
+        self.cellNodes = None
+
+        # Affine cells (see getAffine) with their closed forms over a non-affine root cell, and the topological levels
+        # of the sheet with each affine cell placed right after its root. Built by buildAffineChains()
+        self.affineChains = None
+        self.affineLevels = None
+
+        # The sheet as a sparse lower-triangular system in CSR form, if every formula is linear (see buildLinearSystem)
+        self.linearSystem = None
+
+        # Number of worker processes used by the "parallel" and "sharded" engines (threads for the "threaded" engine)
+        self.workers = os.cpu_count() or 1
+
+        # Work of fewer cells than this (a level, or a whole sheet for the "sharded" engine) is evaluated
+        # by the main process, since sending it to the workers costs more than evaluating it
+        self.minParallelCells = 5000
+
+        # Parse the input file across worker processes (see parseParallel); files of fewer than minParallelCells
+        # cells are parsed by the main process
+        self.parallelParsing = False
+
+        # Parse rows only when a cell in them is first needed (see parseRow); parseInput then only indexes the rows.
+        # For lazy parsing, the byte offset of each row in the input file, the mapped input file (released once every
+        # row is parsed, or by close()), per row whether it has been parsed yet, and the number of rows left to parse
+        self.lazyParsing = False
+        self.rowOffsets = None
+        self.inputData = None
+        self.parsedRows = None
+        self.unparsedRowCount = 0
+
+        # Opt-in iterative calculation of circular references (as in Excel): instead of being marked #CYCLE!,
+        # the cells of each cycle are recalculated until no value changes by more than maxChange, or for at most
+        # maxIterations sweeps. Overrides the engine choice; see evaluateCircular()
+        self.iterativeCalculation = False
+        self.maxIterations = 100
+        self.maxChange = 0.001
+
+        # Reuse evaluation plans (see PLAN_ATTRIBUTES) between sheets whose formulas differ only in their numeric
+        # literals, keyed by structure hash; see restorePlan(). Plans are kept in memory, and also as files in
+        # planCacheDir if it is set. structureHash is the sheet's hash once computed
+        self.usePlanCache = False
+        self.planCacheDir = None
+        self.structureHash = None
+
+    '''
+    Parses the input file, assuming the aforementioned pre-conditions are met (see SpreadsheetEval header comment)
+    
+    Populates row offsets of spreadsheet grid and compiles every expression (see compileExpression).
+        Every row is split first so that cell references (including forward ones) can be resolved to cell IDs
+
+    Plain numbers are converted straight into the value buffer and literal-only expressions are folded,
+        so constant cells never reach the evaluation engines or the dependency graph
+
+    The file is memory-mapped and split into rows and cells as bytes, without decoding it (see compileCellBytes).
+        A first pass indexes the byte offset of every row; with parallelParsing set, the rows are then compiled
+        across worker processes (see parseParallel). With lazyParsing set, no row is compiled yet (see parseRow)
+    '''
+    def parseInput(self):
+        with open(self.inputFile, 'rb') as file, self.mapInput(file) as data:
+            # Rows are split like text-mode reading: on \n, \r\n or a lone \r
+            if not data or data.find(b"\r") >= 0:
+                rows = data[:].splitlines(keepends=True)
+            else:
+                rows = iter(data.readline, b"")
+
+            # Rows read by this pass are kept for compiling right after it; lazy and parallel parsing instead index the
+            # byte offset of every row, and read the rows again later by their offsets
+            keptRows = [] if not self.lazyParsing and not self.parallelParsing else None
+
+            cellCount = 0
+            rowOffsets = array('q', [0])
+            for row in rows:
+                cellCount += row.count(b",") + 1
+
+                # Ensure spreadsheet has at most [maxCells] cells
+                if cellCount > self.maxCells:
+                    raise Exception(f"Input file contains more than maximum number of allowed cells ({self.maxCells})")
+
+                self.rowStart.append(cellCount)
+                if keptRows is not None:
+                    keptRows.append(row)
+                else:
+                    rowOffsets.append(rowOffsets[-1] + len(row))
+
+            self.values = array('d', bytes(8 * cellCount))
+            self.cellState = bytearray(cellCount)
+            self.codeStart = array('q', bytes(8 * cellCount))
+            self.codeEnd = array('q', bytes(8 * cellCount))
+
+            if self.lazyParsing:
+                # A mapping of its own, which stays open after the file is closed
+                self.inputData = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if data else b""
+                self.rowOffsets = rowOffsets
+                self.parsedRows = bytearray(len(rowOffsets) - 1)
+                self.unparsedRowCount = len(rowOffsets) - 1
+            elif self.parallelParsing and self.workers > 1 and cellCount >= self.minParallelCells:
+                self.parseParallel(rowOffsets)
+            elif keptRows is not None:
+                cellId = 0
+                for row in keptRows:
+                    cellId = self.compileRow(cellId, row)
+            else:
+                self.compileRows(data, rowOffsets, 0, len(rowOffsets) - 1)
+
+    '''
+    Saves the parsed and compiled sheet to a binary snapshot file, which loadSnapshot() reads back without parsing
+
+    The snapshot holds the grid, the instruction stream and constant pool, the values and states set while
+        compiling, the dependency graph (precedents and dependents in CSR form: a start offset per cell into
+        a flat list of cell IDs), the topological order and the parse error messages; see SNAPSHOT_SECTIONS.
+        Evaluation results are not saved: cells with code are stored unevaluated
+    '''
+    def saveSnapshot(self, path):
+        cells = self.formulaCells()
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        cellState = bytearray(self.cellState)
+        for cell in cells:
+            cellState[cell] = UNVISITED
+
+        sections = {
+            "rowStart": self.rowStart, "codeStart": self.codeStart, "codeEnd": self.codeEnd,
+            "opcodes": array('B', self.opcodes), "operands": self.operands, "constants": self.constants,
+            "values": self.values, "cellState": array('B', cellState), "topoOrder": array('q', self.topoOrder),
+        }
+        for name, graph in (("precedent", self.precedents), ("dependent", self.dependents)):
+            starts = array('q', [0])
+            ids = array('q')
+            for cellId in range(len(self.cellState)):
+                ids.extend(graph.get(cellId, ()))
+                starts.append(len(ids))
+            sections[name + "Start"] = starts
+            sections[name + "Ids"] = ids
+
+        parseErrors = {cellId: message for cellId, message in self.errorMessages.items() if self.cellState[cellId] == ERROR_PARSE}
+        messages = [message.encode() for message in parseErrors.values()]
+        sections["errorCells"] = array('q', parseErrors)
+        sections["errorLengths"] = array('q', [len(message) for message in messages])
+        sections["errorText"] = array('B', b"".join(messages))
+
+        with open(path, 'wb') as out:
+            out.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(SNAPSHOT_SECTIONS)))
+            out.write(struct.pack(f"<{len(SNAPSHOT_SECTIONS)}Q", *(len(sections[name]) for name, typecode in SNAPSHOT_SECTIONS)))
+            for name, typecode in SNAPSHOT_SECTIONS:
+                data = sections[name].tobytes()
+                out.write(data + bytes(-len(data) % 8))
+
+    '''
+    Loads a sheet saved by saveSnapshot(), in place of parseInput()
+
+    The file is memory-mapped and every section is copied straight into its array, so nothing is parsed. The
+        dependency graph is kept in CSR form (see CompressedGraph) rather than turned back into dicts
+    '''
+    def loadSnapshot(self, path):
+        with open(path, 'rb') as file, self.mapInput(file) as data, memoryview(data) as view:
+            headerSize = SNAPSHOT_HEADER.size + 8 * len(SNAPSHOT_SECTIONS)
+            if len(data) < headerSize:
+                raise Exception(f"{path} is not a spreadsheet snapshot")
+            magic, version, sectionCount = SNAPSHOT_HEADER.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or sectionCount != len(SNAPSHOT_SECTIONS):
+                raise Exception(f"{path} is not a spreadsheet snapshot (version {SNAPSHOT_VERSION})")
+            counts = struct.unpack_from(f"<{sectionCount}Q", data, SNAPSHOT_HEADER.size)
+
+            sections = {}
+            offset = headerSize
+            for (name, typecode), count in zip(SNAPSHOT_SECTIONS, counts):
+                section = array(typecode)
+                size = count * section.itemsize
+                if offset + size > len(data):
+                    raise Exception(f"{path} is not a spreadsheet snapshot (truncated)")
+                section.frombytes(view[offset:offset + size])
+                sections[name] = section
+                offset += size + (-size % 8)
+
+        self.rowStart = sections["rowStart"]
+        self.codeStart = sections["codeStart"]
+        self.codeEnd = sections["codeEnd"]
+        self.opcodes = bytearray(sections["opcodes"])
+        self.operands = sections["operands"]
+        self.constants = sections["constants"]
+        self.values = sections["values"]
+        self.cellState = bytearray(sections["cellState"])
+        self.topoOrder = sections["topoOrder"].tolist()
+
+        # The graph stays in CSR form; lists are only built for the cells an engine looks up
+        starts = sections["precedentStart"]
+        self.precedents = CompressedGraph(starts, sections["precedentIds"], bytearray(map(operator.ne, self.codeStart, self.codeEnd)))
+        starts = sections["dependentStart"]
+        self.dependents = CompressedGraph(starts, sections["dependentIds"], bytearray(map(operator.ne, starts[:-1], starts[1:])))
+
+        text = sections["errorText"].tobytes()
+        position = 0
+        for cellId, length in zip(sections["errorCells"], sections["errorLengths"]):
+            self.errorMessages[cellId] = text[position:position + length].decode()
+            position += length
+
+    '''
+    Returns the sheet's structure hash: a hash of the grid's layout and compiled code with numeric literals left out,
+        so sheets whose formulas differ only in their numeric literals (and in their plain numbers) hash the same
+
+    Literals are only ever read through the constant pool, by index, so such sheets share their whole evaluation
+        plan. Identical expressions share code (see byteExpressionIndex), so sheets where literals differ in whether
+        they repeat hash differently, as do sheets whose literal-only expressions fold differently
+    '''
+    def getStructureHash(self):
+        if self.parsedRows is not None:
+            self.parseRemainingRows()
+
+        hasher = hashlib.blake2b(digest_size=16)
+        for part in (self.rowStart, self.codeStart, self.codeEnd, self.opcodes, self.operands):
+            hasher.update(part)
+        return hasher.hexdigest()
+
+    '''
+    Returns the path of the plan cache file for the sheet's structure hash; generated code is only valid for the
+        Python version that compiled it, so the version is part of the name
+    '''
+    def getPlanPath(self):
+        return os.path.join(self.planCacheDir, f"{self.structureHash}.{sys.implementation.cache_tag}.plan")
+
+    '''
+    Restores the parts of the evaluation plan (see PLAN_ATTRIBUTES) cached for a sheet with the same structure hash,
+        from memory or else from planCacheDir, skipping graph building and code generation; only the constants
+        of this sheet are then used. Parts this sheet already has (e.g. loaded from a snapshot) are kept
+
+    Plans are stored marshalled, so every restore gets fresh objects, which later edits (see setCell) may change freely
+    '''
+    def restorePlan(self):
+        self.structureHash = self.getStructureHash()
+        entry = cachedPlans.get(self.structureHash)
+        if entry is not None:
+            cachedPlans.move_to_end(self.structureHash)
+            parts = marshal.loads(entry[1])
+        elif self.planCacheDir is not None:
+            try:
+                with open(self.getPlanPath(), 'rb') as file:
+                    data = file.read()
+                parts = marshal.loads(data)
+            except (OSError, EOFError, ValueError, TypeError): # Missing or unreadable files are cache misses
+                return
+            self.cachePlan((frozenset(parts), data))
+        else:
+            return
+
+        if self.topoOrder is None and "topoOrder" in parts:
+            self.precedents = parts["precedents"]
+            self.dependents = parts["dependents"]
+            self.topoOrder = parts["topoOrder"]
+        for name in ("levels", "components", "templateGroups", "generatedCode"):
+            if name in parts and getattr(self, name) is None:
+                setattr(self, name, parts[name])
+
+    '''
+    Caches the parts of the evaluation plan built so far under the sheet's structure hash, in memory and in
+        planCacheDir if it is set. Nothing is stored if the cached plan already has every part
+    '''
+    def storePlan(self):
+        if self.topoOrder is None:
+            return
+        if self.structureHash is None:
+            self.structureHash = self.getStructureHash()
+
+        parts = {name: getattr(self, name) for name in PLAN_ATTRIBUTES if getattr(self, name) is not None}
+        for name in ("precedents", "dependents"):
+            if type(parts[name]) is not dict: # Loaded from a snapshot
+                parts[name] = dict(parts[name])
+        entry = cachedPlans.get(self.structureHash)
+        if entry is not None and entry[0] >= parts.keys():
+            return
+
+        entry = (frozenset(parts), marshal.dumps(parts))
+        self.cachePlan(entry)
+
+        if self.planCacheDir is not None:
+            os.makedirs(self.planCacheDir, exist_ok=True)
+            path = self.getPlanPath()
+            # Written under a temporary name first, so other processes never read a partial file
+            temporaryPath = f"{path}.{os.getpid()}.tmp"
+            with open(temporaryPath, 'wb') as out:
+                out.write(entry[1])
+            os.replace(temporaryPath, path)
+
+    '''
+    Puts a plan (as the set of its part names and the marshalled parts) in the in-memory plan cache under the sheet's
+        structure hash, evicting the least recently used plans beyond PLAN_CACHE_SIZE
+    '''
+    def cachePlan(self, entry):
+        cachedPlans[self.structureHash] = entry
+        cachedPlans.move_to_end(self.structureHash)
+        while len(cachedPlans) > PLAN_CACHE_SIZE:
+            cachedPlans.popitem(last=False)
+
+    '''
+    Compiles a row of the input file on first use, with lazy parsing; parsing any cell of the row parses the whole row
+    '''
+    def parseRow(self, rowIndex):
+        if not self.parsedRows[rowIndex]:
+            self.parsedRows[rowIndex] = 1
+            self.compileRows(self.inputData, self.rowOffsets, rowIndex, rowIndex + 1)
+            self.unparsedRowCount -= 1
+            if not self.unparsedRowCount:
+                self.close()
+
+    '''
+    Releases the input file mapped for lazy parsing, which happens by itself once every row is parsed; rows not
+        parsed by then can no longer be parsed. Does nothing otherwise
+    '''
+    def close(self):
+        if isinstance(self.inputData, mmap.mmap):
+            self.inputData.close()
+        self.inputData = None
+
+    '''
+    Compiles the row of the given cell if it has not been parsed yet, with lazy parsing; does nothing otherwise
+    '''
+    def parseCell(self, cellId):
+        if self.parsedRows is not None:
+            self.parseRow(bisect_right(self.rowStart, cellId) - 1)
+
+    '''
+    Compiles all rows not parsed yet, with lazy parsing
+    '''
+    def parseRemainingRows(self):
+        for rowIndex in range(len(self.parsedRows)):
+            self.parseRow(rowIndex)
+
+    '''
+    Compiles the rows [firstRow, lastRow) of the input file, given the file's contents and the byte offset of each row
+    '''
+    def compileRows(self, data, rowOffsets, firstRow, lastRow):
+        cellId = self.rowStart[firstRow]
+        for rowIndex in range(firstRow, lastRow):
+            cellId = self.compileRow(cellId, data[rowOffsets[rowIndex]:rowOffsets[rowIndex + 1]])
+
+    '''
+    Compiles a single row of the input file, given as bytes, whose first cell is cellId; returns the ID of the cell
+        after the row's last cell
+    '''
+    def compileRow(self, cellId, row):
+        if TEXT_ONLY_BYTES.search(row):
+            for expression in row.decode().strip().split(','):
+                self.compileCell(cellId, expression)
+                cellId += 1
+        else:
+            for cell in row.split(b","):
+                self.compileCellBytes(cellId, cell)
+                cellId += 1
+        return cellId
+
+    '''
+    Compiles the input file across a process pool, given the byte offset of each row
+
+    The rows are split into ranges of about equal numbers of cells, TASKS_PER_WORKER per worker. Every worker gets
+        the row index once when it starts (see initParseWorker), so it can resolve references anywhere in the sheet,
+        and compiles whole ranges into compact arrays (see parseRowRange). The ranges are stitched back together in
+        order, moving each range's code and constants past those already stitched.
+
+    Identical expressions only share code within a range
+    '''
+    def parseParallel(self, rowOffsets):
+        rowStart = self.rowStart
+        rowCount = len(rowStart) - 1
+        taskSize = max(1, rowStart[-1] // (self.workers * TASKS_PER_WORKER))
+
+        ranges = []
+        firstRow = 0
+        while firstRow < rowCount:
+            lastRow = min(bisect_right(rowStart, rowStart[firstRow] + taskSize) - 1, rowCount)
+            lastRow = max(lastRow, firstRow + 1)
+            ranges.append((firstRow, lastRow))
+            firstRow = lastRow
+
+        with multiprocessing.Pool(self.workers, initializer=initParseWorker,
+                                  initargs=(self.inputFile, rowStart, rowOffsets, self.maxTokensPerCell)) as pool:
+            for (firstRow, lastRow), compiled in zip(ranges, pool.imap(parseRowRange, ranges)):
+                values, cellState, codeStart, codeEnd, opcodes, operands, constants, errorMessages = compiled
+                first = rowStart[firstRow]
+                last = rowStart[lastRow]
+                codeOffset = len(self.opcodes)
+                constantOffset = len(self.constants)
+
+                pc = opcodes.find(PUSH_CONST)
+                while pc >= 0:
+                    operands[pc] += constantOffset
+                    pc = opcodes.find(PUSH_CONST, pc + 1)
+
+                self.opcodes += opcodes
+                self.operands += operands
+                self.constants += constants
+                self.values[first:last] = values
+                self.cellState[first:last] = cellState
+                self.codeStart[first:last] = array('q', [start + codeOffset for start in codeStart])
+                self.codeEnd[first:last] = array('q', [end + codeOffset for end in codeEnd])
+                self.errorMessages.update(errorMessages)
+
+    '''
+    Memory-maps an open input file for reading; empty files, which cannot be mapped, give empty bytes
+    '''
+    @contextmanager
+    def mapInput(self, file):
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b""
+            return
+
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            data.close()
+
+    '''
+    Compiles the raw contents of a single cell given as ASCII bytes, whose code range must be empty
+
+    Equivalent to compileCell, but tokens are classified straight from the bytes (see TOKEN_PATTERN), so no strings
+        are made for numbers, references or operators. Only the common case is handled here: cells that are empty,
+        plain numbers, or valid expressions referencing at least one cell. Anything else (errors, literal-only
+        expressions) is compiled again by compileCell, so error messages and folding are the same
+    '''
+    def compileCellBytes(self, cellId, cell):
+        tokens = cell.split()
+        if not tokens: # For empty cells
+            self.cellState[cellId] = EMPTY
+            return
+
+        if len(tokens) == 1:
+            match = TOKEN_PATTERN.fullmatch(tokens[0])
+            if match is not None and match.lastindex == 4: # A plain number
+                self.values[cellId] = float(tokens[0])
+                self.cellState[cellId] = NUMBER
+                return
+
+        key = b" ".join(tokens)
+        interned = self.byteExpressionIndex.get(key)
+        if interned is not None:
+            self.codeStart[cellId], self.codeEnd[cellId] = interned
+            return
+
+        opcodes = self.opcodes
+        operands = self.operands
+        constants = self.constants
+        rowStart = self.rowStart
+        rowCount = len(rowStart) - 1
+        columnIndexes = self.columnIndexes
+        start = len(opcodes)
+        constantCount = len(constants)
+        compiled = len(tokens) <= self.maxTokensPerCell
+        depth = 0
+        foldable = True
+
+        fullmatch = TOKEN_PATTERN.fullmatch
+        for token in tokens if compiled else ():
+            opcode = BYTE_OPERATORS.get(token)
+            if opcode is not None:
+                if depth < 2:
+                    compiled = False
+                    break
+                opcodes.append(opcode)
+                operands.append(0)
+                depth -= 1
+                continue
+
+            match = fullmatch(token)
+            kind = match.lastindex if match is not None else None
+            if kind == 2:
+                letters, digits = match.group(1, 2)
+                rowIndex = int(digits) - 1
+                if rowIndex < 0: # Row 0 makes the token invalid
+                    compiled = False
+                    break
+
+                colIndex = columnIndexes.get(letters)
+                if colIndex is None:
+                    colIndex = columnIndexes[letters] = self.colFormToIndex(letters.decode())
+
+                ref = OUT_OF_GRID
+                if rowIndex < rowCount and colIndex < rowStart[rowIndex + 1] - rowStart[rowIndex]:
+                    ref = rowStart[rowIndex] + colIndex
+                opcodes.append(PUSH_REF)
+                operands.append(ref)
+                depth += 1
+                foldable = False
+            elif kind == 4:
+                opcodes.append(PUSH_CONST)
+                operands.append(len(constants))
+                constants.append(float(token))
+                depth += 1
+            else:
+                compiled = False
+                break
+
+        self.codeStart[cellId] = start
+        self.codeEnd[cellId] = len(opcodes)
+        if not compiled or depth != 1 or foldable:
+            self.discardCode(cellId, constantCount)
+            self.compileCell(cellId, cell.decode())
+        else:
+            self.byteExpressionIndex[key] = (start, len(opcodes))
+
+    '''
+    Compiles the raw contents of a single cell, whose code range must be empty
+    '''
+    def compileCell(self, cellId, expression):
+        expression = expression.strip()
+        if not expression: # For empty cells
+            self.cellState[cellId] = EMPTY
+        elif expression not in OPERATORS and NUMBER_PATTERN.fullmatch(expression):
+            self.values[cellId] = float(expression)
+            self.cellState[cellId] = NUMBER
+        else:
+            self.compileExpression(cellId, expression.split())
+
+    '''
+    Compiles a cell's expression tokens into bytecode, appended to the instruction stream
+
+    Each token is classified once: references become PUSH_REF (resolved to a cell ID), numbers
+        become PUSH_CONST and operators become ADD/SUB/MUL/DIV. The operand count of post-order syntax
+        is known at compile time, so operand errors are found here too.
+
+    A cell whose expression cannot be compiled gets no code and is set to #PARSE! right away, with the reason
+        kept in the error messages. Expressions made up only of literals are folded to their value (see foldConstant)
+
+    Expressions are interned: a cell with the same tokens as an already compiled cell shares its code
+    '''
+    def compileExpression(self, cellId, ops):
+        key = " ".join(ops)
+        interned = self.expressionIndex.get(key)
+        if interned is not None:
+            self.codeStart[cellId], self.codeEnd[cellId] = interned
+            return
+
+        opcodes = self.opcodes
+        operands = self.operands
+        start = len(opcodes)
+        self.codeStart[cellId] = start
+        constantCount = len(self.constants)
+        foldable = True
+        error = None
+
+        if len(ops) > self.maxTokensPerCell:
+            error = f"Expression too long in {self.getCellNameById(cellId)} - max of {self.maxTokensPerCell} tokens in a cell"
+        else:
+            depth = 0
+            for op in ops:
+                if op in OPERATORS:
+                    if depth < 2:
+                        error = f"Need at least 1 operand for {op} in {self.getCellNameById(cellId)}"
+                        break
+                    opcodes.append(OPERATORS[op])
+                    operands.append(0)
+                    depth -= 1
+                elif self.isCellReference(op):
+                    opcodes.append(PUSH_REF)
+                    operands.append(self.resolveReference(op))
+                    depth += 1
+                    foldable = False
+                elif NUMBER_PATTERN.fullmatch(op):
+                    try:
+                        value = float(op)
+                    except Exception:
+                        error = f"Error evaluating number {op} in {self.getCellNameById(cellId)}"
+                        break
+                    opcodes.append(PUSH_CONST)
+                    operands.append(len(self.constants))
+                    self.constants.append(value)
+                    depth += 1
+                else:
+                    error = f"Invalid token '{op}' in {self.getCellNameById(cellId)}"
+                    break
+            else:
+                if depth != 1:
+                    error = f"Invalid expression in {self.getCellNameById(cellId)}"
+
+        self.codeEnd[cellId] = len(opcodes)
+
+        if error is not None:
+            self.discardCode(cellId, constantCount)
+            self.cellState[cellId] = ERROR_PARSE
+            self.errorMessages[cellId] = error
+        elif foldable:
+            self.foldConstant(cellId, constantCount)
+        else:
+            self.expressionIndex[key] = (start, self.codeEnd[cellId])
+
+    '''
+    Folds a literal-only cell to its value (which may be an error, e.g. #DIV/0!)
+    '''
+    def foldConstant(self, cellId, constantCount):
+        value = self.evaluateExpression(cellId)
+        self.discardCode(cellId, constantCount)
+        self.setValue(cellId, value)
+
+    '''
+    Discards the code most recently compiled for a cell, along with the constants it added to the pool
+    '''
+    def discardCode(self, cellId, constantCount):
+        start = self.codeStart[cellId]
+        del self.opcodes[start:]
+        del self.operands[start:]
+        del self.constants[constantCount:]
+        self.codeEnd[cellId] = start
+
+    '''
+    Resolves a cell reference token to the referenced cell ID
+    '''
+    def resolveReference(self, op):
+        colCount = len(op.rstrip("0123456789"))
+        letters = op[:colCount]
+        if not letters.isascii(): # Uppercase letters outside A-Z never name a column
+            return OUT_OF_GRID
+
+        return self.getCellId(self.colFormToIndex(letters), int(op[colCount:]) - 1)
+
+    '''
+    Converts 0-based index to column name according to spreadsheet conventions.
+    
+    Assumes [A, B, C, ..., Y, Z, AA, AB, ..., AZ, BA, BB, ...]
+    '''
+    def indexToColForm(self, index):
+        columnName = ""
+
+        while (index >= 0):
+            columnName = chr(ord('A') + (index % 26)) + columnName
+            index = (index // 26) - 1
+
+        return columnName
+
+    '''
+    Converts (row, col) to respective cell mapping according to spreadsheet conventions.
+    
+    Anchored at (0, 0)
+    '''
+    def getCellName(self, colIndex, rowIndex):
+        col = self.indexToColForm(colIndex)
+        return f"{col}{rowIndex+1}"
+
+    '''
+    Converts column name to 0-based index; inverse of indexToColForm
+    '''
+    def colFormToIndex(self, columnName):
+        index = 0
+        for char in columnName:
+            index = index * 26 + (ord(char) - ord('A') + 1)
+        return index - 1
+
+    '''
+    Converts (row, col) to cell ID, or OUT_OF_GRID if there is no such cell in the spreadsheet
+    '''
+    def getCellId(self, colIndex, rowIndex):
+        if rowIndex >= len(self.rowStart) - 1:
+            return OUT_OF_GRID
+
+        rowStart = self.rowStart[rowIndex]
+        if colIndex >= self.rowStart[rowIndex + 1] - rowStart:
+            return OUT_OF_GRID
+
+        return rowStart + colIndex
+
+    '''
+    Converts cell ID back to its cell name; only needed for output and error reporting
+    '''
+    def getCellNameById(self, cellId):
+        rowIndex = bisect_right(self.rowStart, cellId) - 1
+        return self.getCellName(cellId - self.rowStart[rowIndex], rowIndex)
+
+    '''
+    Returns the evaluated value of a cell: a float, "" for empty cells, the error value (e.g. "#DIV/0!")
+        for cells in error, or None if not yet evaluated
+    '''
+    def getValue(self, cellId):
+        state = self.cellState[cellId]
+        if state == NUMBER:
+            return self.values[cellId]
+        if state == EMPTY:
+            return ""
+        if state in ERROR_TEXT:
+            return ERROR_TEXT[state]
+        return None
+
+    '''
+    Stores the evaluated result of a cell: a float, EMPTY_OPERAND or an error value
+    '''
+    def setValue(self, cellId, value):
+        if type(value) is float:
+            self.values[cellId] = value
+            self.cellState[cellId] = NUMBER
+        else:
+            self.cellState[cellId] = value.state
+
+    '''
+    Returns the operand for a reference to the given cell, which must already be evaluated
+    '''
+    def getOperand(self, cellId):
+        if cellId == OUT_OF_GRID:
+            return ERROR_VALUES[ERROR_REF]
+
+        state = self.cellState[cellId]
+        return self.values[cellId] if state == NUMBER else STATE_OPERANDS[state]
+
+    '''
+    Returns the IDs of all in-grid cells referenced by a cell's compiled expression, in order (with repeats)
+    '''
+    def getReferences(self, cellId):
+        opcodes = self.opcodes
+        operands = self.operands
+        return [
+            operands[pc] for pc in range(self.codeStart[cellId], self.codeEnd[cellId])
+            if opcodes[pc] == PUSH_REF and operands[pc] != OUT_OF_GRID
+        ]
+
+    '''
+    Lists every error that originates in a cell, as (cell ID, message) pairs in grid order
+
+    Cells that only inherit an error from a precedent are not listed, since the error's cause is reported
+        at its origin. Division by zero, out-of-grid references and empty operands are recognised as origins
+        by none of the cell's precedents holding the same error
+    '''
+    def getErrors(self):
+        cellState = self.cellState
+        errors = []
+        for cellId, state in enumerate(cellState):
+            if state < ERROR_DIV0:
+                continue
+
+            if cellId in self.errorMessages:
+                errors.append((cellId, self.errorMessages[cellId]))
+            elif state in (ERROR_DIV0, ERROR_REF, ERROR_VALUE):
+                if any(cellState[ref] == state for ref in self.getReferences(cellId)):
+                    continue
+
+                name = self.getCellNameById(cellId)
+                if state == ERROR_DIV0:
+                    errors.append((cellId, f"Division by zero in {name}"))
+                elif state == ERROR_REF:
+                    errors.append((cellId, f"Reference to a cell outside the grid in {name}"))
+                else:
+                    errors.append((cellId, f"Empty cell used as an operand in {name}"))
+        return errors
+
+    '''
+    Evaluates all expressions in each cell of the spreadsheet
+
+    Iterates through cell-by-cell, using the selected engine to handle cell references:
+        "iterative" - explicit work stack, safe for reference chains of any depth (default)
+        "recursive" - recursive DFS, limited by Python's recursion limit
+        "topological" - evaluates every cell exactly once in a precomputed topological order
+        "codegen" - runs the whole sheet as generated Python code, in topological order
+        "parallel" - evaluates the cells of each topological level concurrently in a process pool
+        "sharded" - evaluates independent blocks of cells (connected components) concurrently in a process pool
+        "threaded" - work-stealing thread pool for free-threaded Python builds; topological on builds with a GIL
+        "subinterpreters" - evaluates the cells of each topological level concurrently in subinterpreters (Python 3.14+)
+        "vectorized" - evaluates cells sharing a relative formula template with one NumPy operation per level
+        "shared" - evaluates each distinct sub-expression of the sheet once, sharing results between cells
+        "affine" - collapses chains of affine cells (e.g. A2 = A1 1 +) into closed forms; see evaluateAffine
+        "linear" - solves sheets made up only of linear formulas as one sparse triangular system; see evaluateLinear
+
+    Values of all cells are stored as floats. Errors never abort evaluation; the cell gets an error value instead
+        (see getErrors), which propagates to every cell that depends on it
+
+    With iterativeCalculation set, the sheet is evaluated by evaluateCircular() whatever the engine
+
+    With usePlanCache set, the engine starts from the cached plan of a sheet with the same structure, if there is
+        one (see restorePlan), and the plan it ends up with is cached in turn (see storePlan). The engines of
+        CELL_ENGINES have no plan, so the cache is not used with them (unless iterativeCalculation is set)
+    '''        
+    def evaluate(self):
+        usePlanCache = self.usePlanCache and (self.iterativeCalculation or self.engine not in CELL_ENGINES)
+        if usePlanCache:
+            self.restorePlan()
+
+        self.runEngine()
+
+        if usePlanCache:
+            self.storePlan()
+
+    '''
+    Evaluates the sheet with the selected engine; see evaluate()
+    '''
+    def runEngine(self):
+        if self.iterativeCalculation:
+            self.evaluateCircular()
+            return
+
+        engines = {
+            "iterative": self.evaluateCellByCell,
+            "recursive": self.evaluateCellByCell,
+            "topological": self.evaluateTopological,
+            "codegen": self.evaluateGenerated,
+            "parallel": self.evaluateParallel,
+            "sharded": self.evaluateSharded,
+            "threaded": self.evaluateThreaded,
+            "subinterpreters": self.evaluateSubinterpreters,
+            "vectorized": self.evaluateVectorized,
+            "shared": self.evaluateShared,
+            "affine": self.evaluateAffine,
+            "linear": self.evaluateLinear,
+        }
+        if self.engine not in engines:
+            raise Exception(f"Unknown evaluation engine '{self.engine}'")
+        engines[self.engine]()
+
+    '''
+    Per-cell evaluation ("iterative" and "recursive" engines); evaluates every cell with code in grid order, each
+        one evaluating its unevaluated precedents first, with evaluateIterative() or evaluateDFS() respectively
+    '''
+    def evaluateCellByCell(self):
+        if self.engine == "recursive":
+            evaluateCell = lambda cell: self.evaluateDFS(cell, {})
+        else:
+            evaluateCell = self.evaluateIterative
+
+        for cellId in self.formulaCells():
+            evaluateCell(cellId)
+
+        # The cells marked while walking into a cycle may not be all of it; redo the cycles as a whole
+        if ERROR_CYCLE in self.cellState:
+            self.evaluateCyclicCells()
+
+    '''
+    Returns the IDs of all cells that have compiled code to evaluate, in grid order
+
+    With lazy parsing, every row is parsed first, since all cells are asked for
+    '''
+    def formulaCells(self):
+        if self.parsedRows is not None:
+            self.parseRemainingRows()
+
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+        return [cellId for cellId in range(len(codeStart)) if codeStart[cellId] != codeEnd[cellId]]
+
+    '''
+    Marks the cells of a circular reference as #CYCLE!
+
+    Takes the cells currently being evaluated (outermost first) and the cell that was referenced again;
+        that cell and every cell after it form the cycle. Returns the position of that cell in the list
+    '''
+    def markCycle(self, path, cell):
+        index = len(path) - 1
+        while path[index] != cell:
+            index -= 1
+
+        for member in path[index:]:
+            self.cellState[member] = ERROR_CYCLE
+        self.errorMessages[cell] = f"Circular reference at {self.getCellNameById(cell)}"
+        return index
+
+    '''
+    Core evaluation function; recursively evaluates a cell's expression using DFS
+
+    Takes in the cell to be evaluated (as identified by cell ID) and the cells currently being evaluated
+        (a dict used as an ordered set), populates value buffer, and returns the evaluated result of cell
+
+    Follows specific version of post-order syntax, where the presence of an operator immediately
+        signifies that all previously seen operands should be consumed using that operation
+
+    As an example, 2 3 + 4 * is the correct syntax for the expression (2+3) * 4
+
+    Detects any circular references; all cells of the cycle become #CYCLE!
+    '''
+    def evaluateDFS(self, cell, visiting):
+        queue = deque()
+        
+        if cell == OUT_OF_GRID or self.cellState[cell] > VISITING:
+            return self.getOperand(cell)
+        
+        if cell in visiting:
+            self.markCycle(list(visiting), cell)
+            return ERROR_VALUES[ERROR_CYCLE]
+
+        visiting[cell] = None
+
+        opcodes = self.opcodes
+        operands = self.operands
+        
+        for pc in range(self.codeStart[cell], self.codeEnd[cell]):
+            opcode = opcodes[pc]
+
+            if opcode == PUSH_REF:
+                queue.append(self.evaluateDFS(operands[pc], visiting))
+                if self.cellState[cell] == ERROR_CYCLE: # This cell turned out to be part of a cycle
+                    del visiting[cell]
+                    return ERROR_VALUES[ERROR_CYCLE]
+            elif opcode == PUSH_CONST:
+                queue.append(self.constants[operands[pc]])
+            else:
+                a = queue.popleft()
+                b = queue.popleft()
+                queue.append(self.calculate(a, b, opcode))
+
+        res = queue.pop()
+        self.setValue(cell, res)
+        del visiting[cell]
+        return res
+
+    '''
+    Iterative evaluation engine; evaluates a cell's expression without recursion
+
+    Equivalent to evaluateDFS, but each cell being evaluated is a frame on an explicit work stack
+        holding the cell, the position of its next instruction and its operand queue.
+        When an unevaluated reference is reached, the current frame is suspended at that instruction
+        and the referenced cell is pushed; once that cell is done the frame resumes where it left off.
+
+    Cell states (UNVISITED/VISITING/NUMBER/EMPTY/errors) replace the per-call visiting set, so reference chains
+        of any depth are evaluated in linear time. A reference to a cell that is still VISITING closes a cycle:
+        the frames of the cycle are marked #CYCLE! and dropped, and the frame below resumes with the error value
+
+    With lazy parsing, the rows of the cell and of every cell it reaches are parsed on the way, and no others
+    '''
+    def evaluateIterative(self, cell):
+        self.parseCell(cell)
+        if self.cellState[cell] > VISITING:
+            return self.getValue(cell)
+
+        values = self.values
+        cellState = self.cellState
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+        opcodes = self.opcodes
+        operands = self.operands
+        constants = self.constants
+        calculate = self.calculate
+
+        cellState[cell] = VISITING
+        stack = [[cell, codeStart[cell], deque()]]
+
+        while stack:
+            frame = stack[-1]
+            current, pc, queue = frame
+            end = codeEnd[current]
+
+            suspended = False
+            while pc < end:
+                opcode = opcodes[pc]
+
+                if opcode == PUSH_REF:
+                    ref = operands[pc]
+                    state = cellState[ref] if ref != OUT_OF_GRID else ERROR_REF
+                    if state == NUMBER:
+                        queue.append(values[ref])
+                    elif state > NUMBER:
+                        queue.append(STATE_OPERANDS[state])
+                    elif state == VISITING:
+                        del stack[self.markCycle([entry[0] for entry in stack], ref):]
+                        suspended = True
+                        break
+                    elif codeStart[ref] == codeEnd[ref]:
+                        # Only cells not parsed yet (with lazy parsing) are unvisited without code
+                        self.parseCell(ref)
+                        continue
+                    else:
+                        # Suspend this frame at the reference and evaluate the referenced cell first
+                        frame[1] = pc
+                        cellState[ref] = VISITING
+                        stack.append([ref, codeStart[ref], deque()])
+                        suspended = True
+                        break
+                elif opcode == PUSH_CONST:
+                    queue.append(constants[operands[pc]])
+                else:
+                    a = queue.popleft()
+                    b = queue.popleft()
+                    queue.append(calculate(a, b, opcode))
+
+                pc += 1
+
+            if suspended:
+                continue
+
+            res = queue.pop()
+            if type(res) is float:
+                values[current] = res
+                cellState[current] = NUMBER
+            else:
+                cellState[current] = res.state
+            stack.pop()
+
+        return self.getValue(cell)
+
+    '''
+    Builds the cell -> precedents graph (and its reverse) from the compiled expressions,
+        then orders all non-empty cells using Kahn's algorithm
+
+    Only references to cells with code count as precedents, since other cells' values are already known,
+        but every referenced cell gets its dependents recorded so that edits to constants can be propagated.
+        Cells that are part of (or depend on) a circular reference are left out of the order
+    '''
+    def buildDependencyGraph(self):
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+        cells = self.formulaCells()
+        precedents = {}
+        dependents = {}
+
+        for cell in cells:
+            # dict.fromkeys drops repeated references in order
+            references = list(dict.fromkeys(self.getReferences(cell)))
+            precedents[cell] = [ref for ref in references if codeStart[ref] != codeEnd[ref]]
+            for ref in references:
+                dependents.setdefault(ref, []).append(cell)
+
+        self.precedents = precedents
+        self.dependents = dependents
+        self.topoOrder = self.orderCells(cells, precedents)
+
+    '''
+    Orders the given cells using Kahn's algorithm, counting only precedents that are among the cells themselves
+
+    Cells that are part of (or depend on) a circular reference are left out of the order
+    '''
+    def orderCells(self, cells, precedents):
+        dependents = self.dependents
+        inDegree = {cell: 0 for cell in cells}
+        for cell in cells:
+            for precedent in precedents[cell]:
+                if precedent in inDegree:
+                    inDegree[cell] += 1
+
+        ready = deque(cell for cell, degree in inDegree.items() if degree == 0)
+        order = []
+        while ready:
+            cell = ready.popleft()
+            order.append(cell)
+            for dependent in dependents.get(cell, ()):
+                if dependent in inDegree:
+                    inDegree[dependent] -= 1
+                    if inDegree[dependent] == 0:
+                        ready.append(dependent)
+        return order
+
+    '''
+    Converts a cell name given by the caller (e.g. "B3") to its cell ID, raising an exception for invalid names
+        and cells outside the grid
+    '''
+    def getCellIdByName(self, name):
+        if not self.isCellReference(name):
+            raise Exception(f"Invalid cell name '{name}'")
+        cellId = self.resolveReference(name)
+        if cellId == OUT_OF_GRID:
+            raise Exception(f"Cell {name} is outside the grid")
+        return cellId
+
+    '''
+    Evaluates only the given cells (by name, e.g. ["C10", "Z500"]) and the cells they depend on, and returns their
+        values (see getValue) in the same order. The rest of the sheet is left unevaluated
+
+    Combined with lazy parsing, only the rows of these cells and their precedents are parsed
+    '''
+    def evaluateCells(self, names):
+        cellIds = [self.getCellIdByName(name) for name in names]
+        self.evaluateClosure(cellIds)
+        return [self.getValue(cellId) for cellId in cellIds]
+
+    '''
+    Evaluates the given cells (by ID) and all cells they depend on, directly or not
+
+    Circular references are handled as by evaluate(): every cycle the cells depend on is marked #CYCLE! as a whole
+        (the walk alone only marks the part of a cycle it happens to close), or with iterativeCalculation set,
+        calculated iteratively
+    '''
+    def evaluateClosure(self, cellIds):
+        if self.iterativeCalculation:
+            self.calculateCircular(self.getPrecedentClosure(cellIds))
+        else:
+            for cellId in cellIds:
+                self.evaluateIterative(cellId)
+
+            if ERROR_CYCLE in self.cellState:
+                precedents = self.getPrecedentClosure(cellIds)
+                # Cells in a cycle, or depending on one; components come in topological order
+                affected = set()
+                for component in self.findStronglyConnectedComponents(list(precedents), precedents):
+                    cell = component[0]
+                    if (len(component) > 1 or cell in precedents[cell]
+                            or any(precedent in affected for precedent in precedents[cell])):
+                        affected.update(component)
+
+                cells = sorted(affected)
+                for cell in cells:
+                    self.cellState[cell] = UNVISITED
+                    self.errorMessages.pop(cell, None)
+                self.markCycles(cells, precedents)
+                for cell in cells:
+                    self.evaluateIterative(cell)
+
+    '''
+    Returns the dependency graph (as a precedents dict, see buildDependencyGraph) of the given cells and all cells they
+        depend on, directly or not, without building the whole sheet's graph
+
+    With lazy parsing, only the rows of these cells are parsed
+    '''
+    def getPrecedentClosure(self, cellIds):
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+        precedents = {}
+        pending = list(cellIds)
+        while pending:
+            cell = pending.pop()
+            self.parseCell(cell)
+            if cell in precedents or codeStart[cell] == codeEnd[cell]:
+                continue
+
+            references = list(dict.fromkeys(self.getReferences(cell)))
+            for ref in references:
+                self.parseCell(ref)
+            precedents[cell] = [ref for ref in references if codeStart[ref] != codeEnd[ref]]
+            pending.extend(precedents[cell])
+        return precedents
+
+    '''
+    Changes the expression of a single cell (identified by cell name, e.g. "B3"), keeping the reverse-dependency
+        index up to date. The cell and its dependents are evaluated again by the next call to recalculate()
+
+    The grid's shape is fixed after parsing, so the cell must already exist
+    '''
+    def setCell(self, name, expression):
+        cellId = self.getCellIdByName(name)
+
+        if self.dependents is None:
+            self.buildDependencyGraph()
+        if type(self.dependents) is not dict: # Loaded from a snapshot; edits need lists of their own
+            self.dependents = dict(self.dependents)
+        dependents = self.dependents
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+
+        oldReferences = set(self.getReferences(cellId))
+        hadCode = codeStart[cellId] != codeEnd[cellId]
+        for ref in oldReferences:
+            dependents[ref].remove(cellId)
+
+        # The cell's old code is left unused in the instruction stream; its new code is appended
+        self.codeStart[cellId] = self.codeEnd[cellId] = len(self.opcodes)
+        self.cellState[cellId] = UNVISITED
+        self.errorMessages.pop(cellId, None)
+        self.compileCell(cellId, expression)
+
+        references = set(self.getReferences(cellId))
+        hasCode = codeStart[cellId] != codeEnd[cellId]
+        for ref in references:
+            dependents.setdefault(ref, []).append(cellId)
+
+        self.changedCells.add(cellId)
+
+        # Only the plans built from the changed code are dropped; a number edited into another number changes none
+        # of them but the linear system, which holds the values of referenced numbers
+        if hadCode or hasCode:
+            if references != oldReferences or hadCode != hasCode:
+                self.topoOrder = None
+                self.levels = None
+                self.components = None
+            self.generatedCode = None
+            self.generatedChunks = None
+            self.templateGroups = None
+            self.cellNodes = None
+            self.affineChains = None
+            self.structureHash = None
+        self.linearSystem = None
+
+    '''
+    Evaluates again only the cells changed by setCell() and their transitive dependents, in topological order.
+        Precedents of theirs that have not been evaluated yet are evaluated first. With iterativeCalculation set,
+        circular references among them are calculated iteratively, as by evaluate()
+
+    Returns the IDs of the cells that were evaluated again
+    '''
+    def recalculate(self):
+        dependents = self.dependents or {}
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+
+        affected = set(self.changedCells)
+        pending = list(self.changedCells)
+        while pending:
+            for dependent in dependents.get(pending.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    pending.append(dependent)
+        self.changedCells = set()
+
+        # Cells without code already got their value when they were compiled
+        cells = sorted(cell for cell in affected if codeStart[cell] != codeEnd[cell])
+        precedents = {}
+        for cell in cells:
+            self.cellState[cell] = UNVISITED
+            self.errorMessages.pop(cell, None)
+            precedents[cell] = set(ref for ref in self.getReferences(cell) if codeStart[ref] != codeEnd[ref])
+
+        # Precedents outside the affected cells may not have been evaluated yet (e.g. after evaluateCells())
+        unevaluated = set()
+        for cell in cells:
+            unevaluated.update(ref for ref in precedents[cell] if ref not in affected and self.cellState[ref] == UNVISITED)
+        if unevaluated:
+            self.evaluateClosure(sorted(unevaluated))
+
+        if self.iterativeCalculation:
+            self.calculateCircular(precedents)
+            return cells
+
+        order = self.orderCells(cells, precedents)
+        for cell in order:
+            self.setValue(cell, self.evaluateExpression(cell))
+
+        # Cells left out of the order are part of (or depend on) a circular reference
+        if len(order) < len(cells):
+            ordered = set(order)
+            self.markCycles([cell for cell in cells if cell not in ordered], precedents)
+            for cell in cells:
+                self.evaluateIterative(cell)
+
+        return cells
+
+    '''
+    Finds the strongly connected components of the dependency graph (given as a precedents dict) reachable from the
+        given cells with Tarjan's algorithm, using an explicit stack so reference chains of any depth are fine.
+        Only cells that are keys of precedents are visited, so the graph may cover just part of the sheet
+        (e.g. the cells recalculate() evaluates again)
+
+    Components are returned in topological order: a component comes after every component it references. A component
+        with more than one cell, or a single cell referencing itself, is a circular reference
+    '''
+    def findStronglyConnectedComponents(self, cells, precedents):
+        index = {}
+        lowLink = {}
+        stack = []
+        onStack = set()
+        components = []
+
+        for root in cells:
+            if root in index:
+                continue
+
+            index[root] = lowLink[root] = len(index)
+            stack.append(root)
+            onStack.add(root)
+            work = [(root, iter(precedents.get(root, ())))]
+            while work:
+                cell, refs = work[-1]
+                for ref in refs:
+                    if ref not in precedents:
+                        continue
+                    if ref not in index:
+                        index[ref] = lowLink[ref] = len(index)
+                        stack.append(ref)
+                        onStack.add(ref)
+                        work.append((ref, iter(precedents.get(ref, ()))))
+                        break
+                    if ref in onStack:
+                        lowLink[cell] = min(lowLink[cell], index[ref])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowLink[parent] = min(lowLink[parent], lowLink[cell])
+                    if lowLink[cell] == index[cell]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            onStack.discard(member)
+                            component.append(member)
+                            if member == cell:
+                                break
+                        components.append(component)
+
+        return components
+
+    '''
+    Marks every circular reference among the given cells as #CYCLE! in a single pass (see
+        findStronglyConnectedComponents), with one error message per cycle naming its cells
+    '''
+    def markCycles(self, cells, precedents):
+        for component in self.findStronglyConnectedComponents(cells, precedents):
+            if len(component) == 1 and component[0] not in precedents[component[0]]:
+                continue
+
+            component.sort()
+            for member in component:
+                self.cellState[member] = ERROR_CYCLE
+
+            message = f"Circular reference at {self.getCellNameById(component[0])}"
+            if len(component) > 1:
+                names = ", ".join(self.getCellNameById(member) for member in component[:MAX_CYCLE_MEMBERS])
+                if len(component) > MAX_CYCLE_MEMBERS:
+                    names += f" and {len(component) - MAX_CYCLE_MEMBERS} more"
+                message += f" (cycle of {len(component)} cells: {names})"
+            self.errorMessages[component[0]] = message
+
+    '''
+    Evaluates the cells left out of the topological order, which are part of (or depend on) a circular reference
+
+    All circular references are found at once (see markCycles) and every cell in them becomes #CYCLE!; the
+        remaining cells are then evaluated as usual, inheriting #CYCLE! from the cycles they reference
+    '''
+    def evaluateCyclicCells(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        ordered = set(self.topoOrder)
+        cells = [cell for cell in self.precedents if cell not in ordered]
+        for cell in cells:
+            self.cellState[cell] = UNVISITED
+            self.errorMessages.pop(cell, None)
+
+        self.markCycles(cells, self.precedents)
+        for cell in cells:
+            self.evaluateIterative(cell)
+
+    '''
+    Evaluation with iterative calculation of circular references (see iterativeCalculation)
 
-Input file is a plaintext representation of a single spreadsheet with no more than 500,000 cells (empty or non-empty)
-Output file is a similar plaintext file with the evaluated results for each cell
-'''
-class SpreadsheetEval:
-    def __init__(self, inputFile, outputFile):
-        # Hard cap on max tokens per expression to ensure run-time efficiency that reduces to O(N), where N is number of cells
-        self.maxTokensPerCell = 100
+    Evaluates the strongly connected components of the sheet in topological order. Acyclic cells are evaluated once;
+        the cells of a circular reference start at 0 and are swept in grid order, Gauss-Seidel style (each cell sees
+        the newest values of the others), until the largest change in a sweep is at most maxChange or maxIterations
+        sweeps have run. Cells left unconverged keep their last values
+    '''
+    def evaluateCircular(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
 
-        # Cap on number of cells in input file; given in problem statement
-        self.maxCells = 500000
+        self.calculateCircular(self.precedents)
 
-        # Plaintext input file given as cmd param
-        self.inputFile = inputFile
+    '''
+    Evaluates the cells of the given dependency graph (a precedents dict, with every formula cell referenced by one
+        of its cells among its keys) with iterative calculation of circular references; see evaluateCircular()
+    '''
+    def calculateCircular(self, precedents):
+        values = self.values
+        cellState = self.cellState
 
-        # Output file given as cmd param
-        self.outputFile = outputFile
+        for component in self.findStronglyConnectedComponents(sorted(precedents), precedents):
+            if len(component) == 1 and component[0] not in precedents[component[0]]:
+                self.setValue(component[0], self.evaluateExpression(component[0]))
+                continue
+
+            component.sort()
+            for cell in component:
+                values[cell] = 0.0
+                cellState[cell] = NUMBER
 
-        # A 2D list used to map (row, col) to cell name. Used for ease of outputting.
-        self.grid = []
+            for iteration in range(self.maxIterations):
+                maxChange = 0.0
+                for cell in component:
+                    oldValue = self.getValue(cell)
+                    self.setValue(cell, self.evaluateExpression(cell))
+                    newValue = self.getValue(cell)
+                    if type(oldValue) is float and type(newValue) is float:
+                        maxChange = max(maxChange, abs(newValue - oldValue))
+                    elif oldValue != newValue:
+                        maxChange = math.inf
+                if maxChange <= self.maxChange:
+                    break
 
-        # Maps cell name (key) to raw expression (value)
-        self.exprMap = {}
+    '''
+    Topological evaluation engine; evaluates each non-empty cell exactly once in topological order
 
-        # Maps cell name (key) to its evaluated result (value)
-        self.valMap = {}
+    Since every precedent is evaluated before its dependents, no recursion or visiting checks are needed.
 
+    Any cells left out of the order are part of (or depend on) a circular reference; they are handed
+        to evaluateCyclicCells, which marks the cycles
     '''
-    Parses the input file, assuming the aforementioned pre-conditions are met (see SpreadsheetEval header comment)
-    
-    Populates expression map and map of spreadsheet grid
+    def evaluateTopological(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        for cell in self.topoOrder:
+            self.setValue(cell, self.evaluateExpression(cell))
+
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
+
     '''
-    def parseInput(self):
-        cellCount = 0
-        with open(self.inputFile, 'r') as rows:
-            for rowIndex, row in enumerate(rows):
-                cells = row.strip().split(',')
-                cellCount += len(cells)
-                rowCells = []
-                
-                # Ensure spreadsheet has at most [maxCells] cells
-                if cellCount > self.maxCells:
-                    raise Exception(f"Input file contains more than maximum number of allowed cells ({self.maxCells})")
+    Runs a single cell's compiled expression, assuming all cells it references have already been evaluated
+    '''
+    def evaluateExpression(self, cell):
+        values = self.values
+        cellState = self.cellState
+        opcodes = self.opcodes
+        operands = self.operands
+        queue = deque()
 
-                for colIndex, expression in enumerate(cells):
-                    cell = self.getCellName(colIndex, rowIndex)
-                    rowCells.append(cell)
+        for pc in range(self.codeStart[cell], self.codeEnd[cell]):
+            opcode = opcodes[pc]
 
-                    expression = expression.strip()
-                    if not expression: # For empty cells
-                        self.valMap[cell] = ""
-                        continue
+            if opcode == PUSH_REF:
+                ref = operands[pc]
+                if ref == OUT_OF_GRID:
+                    queue.append(ERROR_VALUES[ERROR_REF])
+                else:
+                    state = cellState[ref]
+                    queue.append(values[ref] if state == NUMBER else STATE_OPERANDS[state])
+            elif opcode == PUSH_CONST:
+                queue.append(self.constants[operands[pc]])
+            else:
+                a = queue.popleft()
+                b = queue.popleft()
+                queue.append(self.calculate(a, b, opcode))
+
+        return queue.pop()
 
-                    self.exprMap[cell] = expression.split()
-                
-                self.grid.append(rowCells)
     '''
-    Converts 0-based index to column name according to spreadsheet conventions.
-    
-    Assumes [A, B, C, ..., Y, Z, AA, AB, ..., AZ, BA, BB, ...]
+    Translates the topologically ordered sheet into Python source and compiles it once
+
+    Each cell becomes one straight-line assignment over a local value list [v], with references as v[id]
+        and numeric literals as c[index] into the constant pool, e.g. v[7] = ((v[0] + c[1]) * v[3]).
+        Since constants are read from the pool, the sheet can be re-evaluated with different constants
+        without generating it again. Error values propagate through the operators themselves (see CellError),
+        and division goes through div() to turn division by zero into #DIV/0!
+
+    Cells are split into functions of at most CODEGEN_CHUNK_SIZE cells to stay within the compiler's limits.
+        A code object already generated (e.g. restored from the plan cache) is only run again to define them
     '''
-    def indexToColForm(self, index):
-        columnName = ""
+    def generateCode(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
 
-        while (index >= 0):
-            columnName = chr(ord('A') + (index % 26)) + columnName
-            index = (index // 26) - 1
+        order = self.topoOrder
+        chunkCount = -(-len(order) // CODEGEN_CHUNK_SIZE)
+        if self.generatedCode is None:
+            lines = []
+            for chunk in range(chunkCount):
+                lines.append(f"def chunk{chunk}(v, c):")
+                for cell in order[chunk * CODEGEN_CHUNK_SIZE:(chunk + 1) * CODEGEN_CHUNK_SIZE]:
+                    lines.append(f"    v[{cell}] = {self.generateExpression(cell)}")
+            self.generatedCode = compile("\n".join(lines), "<spreadsheet>", "exec")
 
-        return columnName
+        namespace = {"div": lambda a, b: self.calculate(a, b, DIV), "REF": ERROR_VALUES[ERROR_REF]}
+        exec(self.generatedCode, namespace)
+        self.generatedChunks = [namespace[f"chunk{index}"] for index in range(chunkCount)]
 
     '''
-    Converts (row, col) to respective cell mapping according to spreadsheet conventions.
-    
-    Anchored at (0, 0)
+    Generates a single Python expression equivalent to a cell's compiled code
+
+    The operand queue is simulated at generation time, so each operator consumes the source of its operands
     '''
-    def getCellName(self, colIndex, rowIndex):
-        col = self.indexToColForm(colIndex)
-        return f"{col}{rowIndex+1}"
+    def generateExpression(self, cell):
+        opcodes = self.opcodes
+        operands = self.operands
+        queue = deque()
+
+        for pc in range(self.codeStart[cell], self.codeEnd[cell]):
+            opcode = opcodes[pc]
+
+            if opcode == PUSH_REF:
+                ref = operands[pc]
+                queue.append(f"v[{ref}]" if ref != OUT_OF_GRID else "REF")
+            elif opcode == PUSH_CONST:
+                queue.append(f"c[{operands[pc]}]")
+            else:
+                a = queue.popleft()
+                b = queue.popleft()
+                if opcode == DIV:
+                    queue.append(f"div({a}, {b})")
+                else:
+                    queue.append(f"({a} {OPERATOR_SOURCE[opcode]} {b})")
+
+        return queue.pop()
 
     '''
-    Evaluates all expressions in each cell of the spreadsheet
+    Code generation engine; runs the generated functions (see generateCode) over a local list of values
 
-    Iterates through cell-by-cell, using DFS to handle cell references
+    Generated code is reused on later calls. As with the topological engine, cells left out of the order
+        are handed to evaluateCyclicCells, which marks the cycles
+    '''
+    def evaluateGenerated(self):
+        if self.generatedChunks is None:
+            self.generateCode()
 
-    Values of all cells are stored as floats
-    '''        
-    def evaluate(self):
-        for row in self.grid:
-            for cell in row:
-                if cell in self.exprMap:
-                    self.evaluateDFS(cell, set())
+        values = self.values
+        v = [values[cellId] if state == NUMBER else STATE_OPERANDS[state] for cellId, state in enumerate(self.cellState)]
+        constants = list(self.constants)
+
+        for chunk in self.generatedChunks:
+            chunk(v, constants)
+
+        for cell in self.topoOrder:
+            self.setValue(cell, v[cell])
+
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
 
     '''
-    Core evaluation function; recursively evaluates a cell's expression using DFS
+    Builds the sheet's expression DAG by hash-consing: the post-order queue of each cell's code is run over node IDs
+        instead of values, and every (opcode, operand, operand) tuple is interned, so a sub-expression such as
+        A1 B1 + gets one node however many cells it appears in.
 
-    Takes in the cell to be evaluated (as identified by cell name), populates value map,
-        and returns evaluated result of cell
+    Leaves are (PUSH_REF, cell ID, 0) and (PUSH_CONST, constant, 0); operators are (opcode, node ID, node ID)
+    '''
+    def buildExpressionNodes(self):
+        opcodes = self.opcodes
+        operands = self.operands
+        constants = self.constants
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+        nodeOpcodes = bytearray()
+        nodeOperands = []
+        nodeIndex = {}
+        cellNodes = {}
+        codeNodes = {} # Root node of each code range, as cells with interned expressions share their code
 
-    Follows specific version of post-order syntax, where the presence of an operator immediately
-        signifies that all previously seen operands should be consumed using that operation
+        for cell in self.formulaCells():
+            root = codeNodes.get(codeStart[cell])
+            if root is not None:
+                cellNodes[cell] = root
+                continue
 
-    As an example, 2 3 + 4 * is the correct syntax for the expression (2+3) * 4
+            queue = deque()
+            for pc in range(codeStart[cell], codeEnd[cell]):
+                opcode = opcodes[pc]
+                if opcode == PUSH_REF:
+                    key = (PUSH_REF, operands[pc], 0)
+                elif opcode == PUSH_CONST:
+                    key = (PUSH_CONST, constants[operands[pc]].hex(), 0) # hex() keeps 0.0 and -0.0 apart
+                else:
+                    key = (opcode, queue.popleft(), queue.popleft())
+
+                node = nodeIndex.get(key)
+                if node is None:
+                    node = nodeIndex[key] = len(nodeOpcodes)
+                    nodeOpcodes.append(opcode)
+                    nodeOperands.append(key[1:] if opcode != PUSH_CONST else (constants[operands[pc]], 0))
+                queue.append(node)
+            cellNodes[cell] = codeNodes[codeStart[cell]] = queue.pop()
+
+        self.nodeOpcodes = nodeOpcodes
+        self.nodeOperands = nodeOperands
+        self.cellNodes = cellNodes
 
-    Detects any circular references and other common errors
     '''
-    def evaluateDFS(self, cell, visiting):
+    Shared evaluation engine; evaluates the cells in topological order over the expression DAG (see
+        buildExpressionNodes), computing each node at most once and sharing its result between all cells using it
+
+    Nodes are numbered in post-order, so a node's operands always have lower IDs. As with the topological engine,
+        cells left out of the order are handed to evaluateCyclicCells, which marks the cycles
+    '''
+    def evaluateShared(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+        if self.cellNodes is None:
+            self.buildExpressionNodes()
+
+        values = self.values
+        cellState = self.cellState
+        nodeOpcodes = self.nodeOpcodes
+        nodeOperands = self.nodeOperands
+        cellNodes = self.cellNodes
+        nodeValues = [None] * len(nodeOpcodes)
+
+        for cell in self.topoOrder:
+            root = cellNodes[cell]
+            if nodeValues[root] is None:
+                # Operands are evaluated before the nodes using them; stack entries are (node, operands done)
+                stack = [(root, False)]
+                while stack:
+                    node, ready = stack.pop()
+                    if nodeValues[node] is not None:
+                        continue
+                    opcode = nodeOpcodes[node]
+                    a, b = nodeOperands[node]
+                    if opcode == PUSH_REF:
+                        if a == OUT_OF_GRID:
+                            nodeValues[node] = ERROR_VALUES[ERROR_REF]
+                        else:
+                            state = cellState[a]
+                            nodeValues[node] = values[a] if state == NUMBER else STATE_OPERANDS[state]
+                    elif opcode == PUSH_CONST:
+                        nodeValues[node] = a
+                    elif ready:
+                        nodeValues[node] = self.calculate(nodeValues[a], nodeValues[b], opcode)
+                    else:
+                        stack.append((node, True))
+                        stack.append((a, False))
+                        stack.append((b, False))
+            self.setValue(cell, nodeValues[root])
+
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
+
+    '''
+    Returns a cell's expression as an affine function of a single referenced cell x, as (x, scale, offset, hasOperator)
+        meaning scale * x + offset, e.g. (A1 ID, 2.0, 1.0, True) for A1 2 * 1 +. hasOperator is False for
+        a plain reference, which passes an empty cell on as empty rather than as #VALUE!
+
+    Only constant operands may be combined with x, and only divisors that are powers of two (whose reciprocal is
+        exact), so the closed form of a single cell is exact. Returns None for any other cell
+    '''
+    def getAffine(self, cellId):
+        opcodes = self.opcodes
+        operands = self.operands
+        ref = None
         queue = deque()
-        
-        if cell in self.valMap:
-            return self.valMap[cell]
-        
-        if cell in visiting:
-            raise Exception(f"Circular reference at {cell}")
-        
-        if cell not in self.exprMap: # Allows for us to effectively skip evaluation of blank cells
-            return ""
 
-        visiting.add(cell)
+        for pc in range(self.codeStart[cellId], self.codeEnd[cellId]):
+            opcode = opcodes[pc]
+            if opcode == PUSH_REF:
+                if ref is not None or operands[pc] == OUT_OF_GRID:
+                    return None
+                ref = operands[pc]
+                # -0.0 is the additive identity: x + -0.0 is x even for x = -0.0
+                queue.append((1.0, -0.0))
+            elif opcode == PUSH_CONST:
+                queue.append(self.constants[operands[pc]])
+            else:
+                a = queue.popleft()
+                b = queue.popleft()
+                if type(a) is float and type(b) is float:
+                    res = self.calculate(a, b, opcode)
+                    if type(res) is not float:
+                        return None
+                elif type(a) is tuple and type(b) is tuple:
+                    return None
+                elif opcode == ADD:
+                    scale, offset = a if type(a) is tuple else b
+                    res = (scale, offset + (b if type(a) is tuple else a))
+                elif opcode == SUB:
+                    res = (a[0], a[1] - b) if type(a) is tuple else (-b[0], a - b[1])
+                elif opcode == MUL:
+                    (scale, offset), factor = (a, b) if type(a) is tuple else (b, a)
+                    res = (scale * factor, offset * factor if offset else offset) # A zero offset stays an identity
+                elif type(a) is tuple and b != 0 and math.frexp(b)[0] in (0.5, -0.5):
+                    res = (a[0] / b, a[1] / b if a[1] else a[1])
+                else:
+                    return None
+                queue.append(res)
+
+        result = queue.pop()
+        if type(result) is not tuple:
+            return None
+        return (ref, result[0], result[1], self.codeEnd[cellId] - self.codeStart[cellId] > 1)
 
-        ops = self.exprMap[cell]
-        
-        for op in ops:
-            if len(ops) > self.maxTokensPerCell:
-                raise Exception(f"Expression too long in {cell} - max of {self.maxTokensPerCell} tokens in a cell")
-
-            if op in {"+", "-", "*", "/"}:
-                if len(queue) < 2:
-                    raise Exception(f"Need at least 1 operand for {op} in {cell}")
-                a = queue.popleft, 
-                b = queue.popleft
-                res = self.calculate(a, b, op)
+    '''
+    Finds the affine cells of the sheet and composes each chain of them into one closed form by pointer jumping
+
+    Every affine cell starts out pointing at the cell it references, with its own scale and offset. In each round,
+        every cell still pointing at an affine cell composes that cell's closed form into its own and skips ahead to
+        what that cell points at, so chains of any length are resolved in O(log n) rounds of NumPy operations.
+        A cell whose closed form overflows or underflows, and every affine cell after it in its chain, is dropped
+        from the affine cells, so it is evaluated like any other cell.
+
+    Also builds the levels used by evaluateAffine(): as buildLevels(), except that an affine cell's only precedent
+        is its root, so a chain of any length takes up just one level after the root's
+    '''
+    def buildAffineChains(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        affine = {}
+        for cell in self.topoOrder:
+            form = self.getAffine(cell)
+            if form is not None:
+                affine[cell] = form
+
+        cells = numpy.fromiter(affine, dtype=numpy.int64, count=len(affine))
+        forms = list(affine.values())
+        parents = numpy.array([form[0] for form in forms], dtype=numpy.int64)
+        scales = numpy.array([form[1] for form in forms], dtype=numpy.float64)
+        offsets = numpy.array([form[2] for form in forms], dtype=numpy.float64)
+        hasOperator = numpy.array([form[3] for form in forms], dtype=bool)
+
+        # Index into the arrays above of each affine cell, or -1 (-2 once an affine cell is left to be evaluated
+        # on its own; see below)
+        affineIndex = numpy.full(len(self.cellState), -1, dtype=numpy.int64)
+        affineIndex[cells] = numpy.arange(len(cells))
+
+        # A closed form is only used while its coefficients stay finite and normal (or exactly zero): beyond that,
+        # the order of operations decides the result (e.g. 0 * 2**1200 is nan, but 0 * 2 * 2 ... stays 0)
+        tiny = numpy.finfo(numpy.float64).tiny
+        def isNormal(x):
+            return numpy.isfinite(x) & ((x == 0) | (numpy.abs(x) >= tiny))
+        def isSafeProduct(product, a, b):
+            return isNormal(product) & ((product != 0) | (a == 0) | (b == 0))
+
+        originalParents = parents.copy()
+        nextIndex = affineIndex[parents]
+        pending = numpy.flatnonzero(nextIndex >= 0)
+        with numpy.errstate(all="ignore"):
+            unsafe = ~isNormal(scales) | ~isNormal(offsets)
+            while len(pending):
+                jump = nextIndex[pending]
+                # (scale * (jumpScale * x + jumpOffset) + offset), computed from the previous round's values
+                scale = scales[pending]
+                scaledOffset = scale * offsets[jump]
+                offsets[pending] = scaledOffset + offsets[pending]
+                scales[pending] = scale * scales[jump]
+                unsafe[pending] |= (unsafe[jump] | ~isSafeProduct(scaledOffset, scale, offsets[jump])
+                    | ~isNormal(offsets[pending]) | ~isSafeProduct(scales[pending], scale, scales[jump]))
+                hasOperator[pending] |= hasOperator[jump]
+                parents[pending] = parents[jump]
+                nextIndex[pending] = nextIndex[jump]
+                pending = pending[nextIndex[pending] >= 0]
+
+        precedents = self.precedents
+        codeStart = self.codeStart
+        codeEnd = self.codeEnd
+        cellLevel = {}
+        levels = []
+        for cell in self.topoOrder:
+            index = affineIndex[cell]
+            # Cells with an unsafe closed form, or whose chain passes through one, are evaluated one at a time
+            if index >= 0 and (unsafe[index] or affineIndex[originalParents[index]] == -2):
+                affineIndex[cell] = index = -2
+            if index >= 0:
+                root = int(parents[index])
+                level = 1 + cellLevel[root] if codeStart[root] != codeEnd[root] else 0
+            else:
+                level = 1 + max((cellLevel[precedent] for precedent in precedents[cell]), default=-1)
+            cellLevel[cell] = level
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(cell)
+
+        self.affineChains = (affineIndex, parents, scales, offsets, hasOperator)
+        self.affineLevels = levels
+
+    '''
+    Affine evaluation engine; evaluates the sheet level by level over the levels of buildAffineChains(), working out
+        all of a level's affine cells at once from their roots with NumPy and the other cells one by one
+
+    Long chains such as A2 = A1 1 +, A3 = A2 1 +, ... become a single vectorized operation instead of a serial walk.
+        Empty and error roots give the same results as the other engines. Numeric results are the same whenever the
+        composed coefficients and intermediate values are exactly representable (e.g. integers below 2**53);
+        otherwise, since rounding happens once per closed form rather than once per cell, they may differ from the
+        other engines in the last bits (or the sign of a zero). Cells whose composed coefficients would overflow or
+        underflow are not given a closed form and are evaluated one at a time (see buildAffineChains).
+
+    Without NumPy this falls back to the topological engine. As with the topological engine, cells left out of the
+        order are handed to evaluateCyclicCells, which marks the cycles
+    '''
+    def evaluateAffine(self):
+        if numpy is None:
+            self.evaluateTopological()
+            return
+
+        if self.affineChains is None:
+            self.buildAffineChains()
+
+        affineIndex, parents, scales, offsets, hasOperator = self.affineChains
+        values = numpy.frombuffer(self.values, dtype=numpy.float64)
+        cellState = numpy.frombuffer(self.cellState, dtype=numpy.uint8)
+
+        for level in self.affineLevels:
+            cells = numpy.array(level, dtype=numpy.int64)
+            indexes = affineIndex[cells]
+            for cell in cells[indexes < 0].tolist():
+                self.setValue(cell, self.evaluateExpression(cell))
+
+            affineCells = cells[indexes >= 0]
+            indexes = indexes[indexes >= 0]
+            roots = parents[indexes]
+            rootState = cellState[roots]
+            with numpy.errstate(all="ignore"):
+                values[affineCells] = scales[indexes] * values[roots] + offsets[indexes]
+
+            # Affine cells take on their root's error; an empty root gives #VALUE! unless only passed on by references
+            state = rootState.copy()
+            state[(rootState == EMPTY) & hasOperator[indexes]] = ERROR_VALUE
+            cellState[affineCells] = state
+
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
+
+    '''
+    Returns a cell's expression as a linear combination of the cells it references, as (coefficients, constant)
+        with coefficients mapping cell ID (key) to its factor (value), e.g. ({A1 ID: 2.0, B1 ID: -1.0}, 3.0) for
+        A1 2 * B1 - 3 +
+
+    Returns None unless the expression only adds and subtracts references and constants, and multiplies or
+        divides them by constants (other than division by zero)
+    '''
+    def getLinear(self, cellId):
+        opcodes = self.opcodes
+        operands = self.operands
+        queue = deque()
+
+        for pc in range(self.codeStart[cellId], self.codeEnd[cellId]):
+            opcode = opcodes[pc]
+            if opcode == PUSH_REF:
+                if operands[pc] == OUT_OF_GRID:
+                    return None
+                queue.append(({operands[pc]: 1.0}, 0.0))
+            elif opcode == PUSH_CONST:
+                queue.append(self.constants[operands[pc]])
+            else:
+                a = queue.popleft()
+                b = queue.popleft()
+                if type(a) is float and type(b) is float:
+                    res = self.calculate(a, b, opcode)
+                    if type(res) is not float:
+                        return None
+                elif opcode == ADD or opcode == SUB:
+                    sign = 1.0 if opcode == ADD else -1.0
+                    coefficients, constant = a if type(a) is tuple else ({}, a)
+                    otherCoefficients, otherConstant = b if type(b) is tuple else ({}, b)
+                    coefficients = dict(coefficients)
+                    for ref, factor in otherCoefficients.items():
+                        coefficients[ref] = coefficients.get(ref, 0.0) + sign * factor
+                    res = (coefficients, constant + sign * otherConstant)
+                elif opcode == MUL and (type(a) is float or type(b) is float):
+                    (coefficients, constant), factor = (a, b) if type(a) is tuple else (b, a)
+                    res = ({ref: coefficient * factor for ref, coefficient in coefficients.items()}, constant * factor)
+                elif opcode == DIV and type(b) is float and b != 0:
+                    coefficients, constant = a
+                    res = ({ref: coefficient / b for ref, coefficient in coefficients.items()}, constant / b)
+                else:
+                    return None
                 queue.append(res)
-            elif self.isCellReference(op):
-                val = self.evaluateDFS(op, visiting)
-                queue.append(val)
-            elif re.match(r"^[+-]?\d*(\.\d+)?$", op):
-                try:
-                    queue.append(float(op))
-                except Exception:
-                    raise Exception(f"Error evaluating number {op} in {cell}")
+
+        result = queue.pop()
+        return result if type(result) is tuple else None
+
+    '''
+    Assembles the sheet into a sparse lower-triangular system (I - L) v = c over its formula cells in topological
+        order, where row i of L holds the coefficients of cell i's references and c the constants, with the values
+        of referenced number cells folded in. The system is kept in CSR form as (cells, rowPointers, columns,
+        coefficients, constants), with columns given as positions in the topological order.
+
+    Sets linearSystem to False if the sheet does not fit: some formula is not linear (see getLinear), some formula
+        references an empty or error cell, some coefficient, constant or referenced number is infinite or nan
+        (which terms folded together, e.g. B1 B1 -, would no longer carry), or there is a circular reference
+    '''
+    def buildLinearSystem(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        self.linearSystem = False
+        if len(self.topoOrder) < len(self.precedents):
+            return
+
+        cells = self.topoOrder
+        position = {cell: index for index, cell in enumerate(cells)}
+        rowPointers = array('q', [0])
+        columns = array('q')
+        coefficients = array('d')
+        constants = array('d')
+
+        for cell in cells:
+            form = self.getLinear(cell)
+            if form is None:
+                return
+            rowCoefficients, constant = form
+            for ref, coefficient in rowCoefficients.items():
+                if not math.isfinite(coefficient):
+                    return
+                if ref in position:
+                    columns.append(position[ref])
+                    coefficients.append(coefficient)
+                elif self.cellState[ref] == NUMBER and math.isfinite(self.values[ref]):
+                    constant += coefficient * self.values[ref]
+                else:
+                    return
+            if not math.isfinite(constant):
+                return
+            rowPointers.append(len(columns))
+            constants.append(constant)
+
+        self.linearSystem = (cells, rowPointers, columns, coefficients, constants)
+
+    '''
+    Linear evaluation engine; solves a sheet whose formulas are all linear as one sparse triangular system (see
+        buildLinearSystem), with SciPy's triangular solver when SciPy is installed and by forward substitution
+        over the CSR rows otherwise
+
+    Results are the same as the other engines' whenever the coefficients and intermediate values are exactly
+        representable (e.g. integers below 2**53); otherwise rounding can differ in the last bits (or the sign of
+        a zero, e.g. -0 A1 A1 + gives 0.0 rather than -0.0), since each cell is computed as its combined linear
+        form rather than operation by operation.
+
+    Sheets that do not fit the system, or whose solution overflows to an infinite or nan value anywhere, are
+        evaluated by the topological engine instead
+    '''
+    def evaluateLinear(self):
+        if self.linearSystem is None:
+            self.buildLinearSystem()
+        if not self.linearSystem:
+            self.evaluateTopological()
+            return
+
+        cells, rowPointers, columns, coefficients, constants = self.linearSystem
+        try: # Imported here, as SciPy is slow to import and only this engine uses it
+            import scipy.sparse
+            import scipy.sparse.linalg
+        except ImportError:
+            scipy = None
+
+        if scipy is not None and numpy is not None:
+            size = len(cells)
+            lower = scipy.sparse.csr_matrix((numpy.frombuffer(coefficients, dtype=numpy.float64),
+                                             numpy.frombuffer(columns, dtype=numpy.int64),
+                                             numpy.frombuffer(rowPointers, dtype=numpy.int64)), shape=(size, size))
+            system = (scipy.sparse.identity(size, format="csr") - lower).tocsr()
+            solution = scipy.sparse.linalg.spsolve_triangular(system, numpy.frombuffer(constants, dtype=numpy.float64), lower=True)
+            finite = bool(numpy.isfinite(solution).all())
+        else:
+            solution = array('d', constants)
+            for row in range(len(cells)):
+                total = solution[row]
+                for index in range(rowPointers[row], rowPointers[row + 1]):
+                    total += coefficients[index] * solution[columns[index]]
+                solution[row] = total
+            finite = all(math.isfinite(value) for value in solution)
+
+        # Once a value overflows, terms folded together (e.g. B1 B1 -) no longer match operation-by-operation results
+        if not finite:
+            self.evaluateTopological()
+            return
+
+        values = self.values
+        cellState = self.cellState
+        for row, cell in enumerate(cells):
+            values[cell] = solution[row]
+            cellState[cell] = NUMBER
+
+    '''
+    Partitions the topologically ordered cells into levels: a cell's level is one more than the highest level
+        of its precedents, so all cells within a level can be evaluated independently of each other
+    '''
+    def buildLevels(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        precedents = self.precedents
+        cellLevel = {}
+        levels = []
+        for cell in self.topoOrder:
+            level = 1 + max((cellLevel[precedent] for precedent in precedents[cell]), default=-1)
+            cellLevel[cell] = level
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(cell)
+
+        self.levels = levels
+
+    '''
+    Moves values and cell states into shared memory for the duration of a process-pool evaluation
+
+    Work done in this process goes through the shared buffers too, so workers always see it. Yields a function that
+        starts the pool on first use, so sheets that never need the workers never pay for them
+    '''
+    @contextmanager
+    def sharedMemoryPool(self):
+        cellCount = len(self.cellState)
+        sharedValues = multiprocessing.RawArray('d', max(cellCount, 1))
+        sharedState = multiprocessing.RawArray('B', max(cellCount, 1))
+        values = memoryview(sharedValues).cast('B').cast('d')
+        cellState = memoryview(sharedState).cast('B')
+        values[:cellCount] = self.values
+        cellState[:cellCount] = self.cellState
+        self.values, self.cellState = values, cellState
+
+        pool = None
+        def getPool():
+            nonlocal pool
+            if pool is None:
+                pool = multiprocessing.Pool(
+                    self.workers,
+                    initializer=initParallelWorker,
+                    initargs=(sharedValues, sharedState, self.codeStart, self.codeEnd,
+                        self.opcodes, self.operands, self.constants),
+                )
+            return pool
+
+        try:
+            yield getPool
+        finally:
+            if pool is not None:
+                pool.terminate()
+            self.values = array('d', values[:cellCount].tobytes())
+            self.cellState = bytearray(cellState[:cellCount])
+            values.release()
+            cellState.release()
+
+    '''
+    Parallel evaluation engine; evaluates the cells of each topological level concurrently across a process pool
+
+    Workers read their precedents and write their results in shared memory (see sharedMemoryPool). Each level is
+        split into one batch per worker, and a level only starts once the previous one is done. Small levels are
+        evaluated by the main process instead (see minParallelCells).
+
+    As with the topological engine, cells left out of the order are handed to evaluateCyclicCells, which marks the cycles
+    '''
+    def evaluateParallel(self):
+        if self.levels is None:
+            self.buildLevels()
+
+        with self.sharedMemoryPool() as getPool:
+            for level in self.levels:
+                if len(level) < self.minParallelCells or self.workers < 2:
+                    for cell in level:
+                        self.setValue(cell, self.evaluateExpression(cell))
+                    continue
+
+                batchSize = -(-len(level) // self.workers)
+                batches = [level[offset:offset + batchSize] for offset in range(0, len(level), batchSize)]
+                getPool().map(evaluateParallelBatch, batches)
+
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
+
+    '''
+    Finds the weakly connected components of the dependency graph using union-find over cell IDs
+
+    Only references between cells with code join components; constants and empty cells are never written during
+        evaluation, so they can be read by any number of components. Each component keeps its cells in topological order
+    '''
+    def buildComponents(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        parent = {cell: cell for cell in self.precedents}
+
+        def find(cell):
+            while parent[cell] != cell:
+                parent[cell] = parent[parent[cell]] # Path halving
+                cell = parent[cell]
+            return cell
+
+        for cell, cellPrecedents in self.precedents.items():
+            for precedent in cellPrecedents:
+                root, precedentRoot = find(cell), find(precedent)
+                if root != precedentRoot:
+                    parent[precedentRoot] = root
+
+        components = {}
+        for cell in self.topoOrder:
+            components.setdefault(find(cell), []).append(cell)
+
+        self.components = list(components.values())
+
+    '''
+    Packs components into tasks for the "sharded" engine
+
+    Aims for TASKS_PER_WORKER tasks per worker: components at least that large get a task of their own, and
+        smaller ones are packed together until a task reaches that size. Tasks are returned largest first,
+        so the longest-running ones start straight away
+    '''
+    def packComponents(self):
+        cellCount = sum(len(component) for component in self.components)
+        targetSize = max(1, cellCount // (self.workers * TASKS_PER_WORKER))
+
+        tasks = []
+        packed = []
+        for component in sorted(self.components, key=len, reverse=True):
+            if len(component) >= targetSize:
+                tasks.append(component)
+                continue
+
+            packed.extend(component)
+            if len(packed) >= targetSize:
+                tasks.append(packed)
+                packed = []
+
+        if packed:
+            tasks.append(packed)
+        return sorted(tasks, key=len, reverse=True)
+
+    '''
+    Sharded evaluation engine; evaluates independent components of the sheet concurrently across a process pool
+
+    Components share no dependencies, so each task runs start to finish on one worker with no synchronisation
+        between tasks (see packComponents). Values are exchanged through shared memory (see sharedMemoryPool).
+        Sheets with fewer than minParallelCells cells to evaluate are evaluated by the main process instead.
+
+    As with the topological engine, cells left out of the order are handed to evaluateCyclicCells, which marks the cycles
+    '''
+    def evaluateSharded(self):
+        if self.components is None:
+            self.buildComponents()
+
+        with self.sharedMemoryPool() as getPool:
+            if len(self.topoOrder) < self.minParallelCells or self.workers < 2:
+                for cell in self.topoOrder:
+                    self.setValue(cell, self.evaluateExpression(cell))
             else:
-                raise Exception(f"Invalid token '{op}' in {cell}")
+                for _ in getPool().imap_unordered(evaluateParallelBatch, self.packComponents()):
+                    pass
 
-        if len(queue) != 1:
-            raise Exception(f"Invalid expression in {cell}")
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
 
-        res = queue.pop()
-        self.valMap[cell] = res
-        visiting.remove(cell)
-        return res
+    '''
+    Threaded evaluation engine for free-threaded (no-GIL) Python builds; see evaluateWorkStealing
+
+    Threads cannot run Python code in parallel while the GIL is enabled, so on those builds this falls back to
+        the (serial) topological engine
+    '''
+    def evaluateThreaded(self):
+        if getattr(sys, "_is_gil_enabled", lambda: True)():
+            self.evaluateTopological()
+        else:
+            self.evaluateWorkStealing()
+
+    '''
+    Evaluates the sheet on a pool of threads that schedule cells as soon as they are ready
+
+    Every cell has a counter of precedents still to be evaluated, and becomes ready when it reaches zero. There are
+        no barriers between topological levels. Each thread keeps its own deque of ready cells: it pushes and pops
+        cells at one end (newly ready dependents are evaluated next, while their precedents are still in cache),
+        and when its deque runs dry it steals from the other end of another thread's deque.
+
+    As with the topological engine, cells left out of the order are handed to evaluateCyclicCells, which marks the cycles
+    '''
+    def evaluateWorkStealing(self):
+        if self.topoOrder is None:
+            self.buildDependencyGraph()
+
+        total = len(self.topoOrder)
+        threadCount = max(1, self.workers)
+        dependents = self.dependents
+        remaining = {cell: len(cellPrecedents) for cell, cellPrecedents in self.precedents.items()}
+        counterLocks = [threading.Lock() for _ in range(COUNTER_LOCKS)]
+        deques = [deque() for _ in range(threadCount)]
+
+        for index, cell in enumerate(cell for cell, count in remaining.items() if count == 0):
+            deques[index % threadCount].append(cell)
+
+        doneLock = threading.Lock()
+        done = 0
+        finished = threading.Event()
+        failures = []
+
+        def steal(thief):
+            victims = list(range(threadCount))
+            random.shuffle(victims)
+            for victim in victims:
+                if victim != thief:
+                    try:
+                        return deques[victim].popleft()
+                    except IndexError:
+                        pass
+            return None
+
+        def work(index):
+            nonlocal done
+            own = deques[index]
+            try:
+                while not finished.is_set():
+                    try:
+                        cell = own.pop()
+                    except IndexError:
+                        cell = steal(index)
+                        if cell is None:
+                            finished.wait(STEAL_BACKOFF)
+                            continue
+
+                    self.setValue(cell, self.evaluateExpression(cell))
+
+                    for dependent in dependents.get(cell, ()):
+                        with counterLocks[dependent % COUNTER_LOCKS]:
+                            remaining[dependent] -= 1
+                            ready = remaining[dependent] == 0
+                        if ready:
+                            own.append(dependent)
+
+                    with doneLock:
+                        done += 1
+                        if done == total:
+                            finished.set()
+            except BaseException as e:
+                failures.append(e)
+                finished.set()
+
+        if total:
+            threads = [threading.Thread(target=work, args=(index,)) for index in range(threadCount)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if failures:
+                raise failures[0]
+
+        if total < len(self.precedents):
+            self.evaluateCyclicCells()
+
+    '''
+    Subinterpreter evaluation engine; evaluates the cells of each topological level concurrently in worker interpreters
+        that each have their own GIL (PEP 734), driven from one thread per interpreter
+
+    Unlike worker processes, interpreters start cheaply and share this process's memory: the compiled code, the value
+        buffer, the cell states and the level-ordered cell IDs are all passed to them as memoryviews, never pickled.
+        Each large level is split into one contiguous slice of the ordered cell IDs per interpreter. As with the
+        "parallel" engine, small levels are evaluated by this interpreter instead (see minParallelCells).
+
+    Python versions without the concurrent.interpreters module fall back to the "parallel" engine
+    '''
+    def evaluateSubinterpreters(self):
+        try:
+            from concurrent import interpreters
+        except ImportError:
+            self.evaluateParallel()
+            return
+
+        if self.levels is None:
+            self.buildLevels()
+
+        order = array('q')
+        for level in self.levels:
+            order.extend(level)
+
+        workers = []
+        failures = []
+
+        def run(interpreter, source):
+            try:
+                interpreter.exec(source)
+            except BaseException as e:
+                failures.append(e)
+
+        try:
+            offset = 0
+            for level in self.levels:
+                start, end = offset, offset + len(level)
+                offset = end
+
+                if len(level) < self.minParallelCells or self.workers < 2:
+                    for cell in level:
+                        self.setValue(cell, self.evaluateExpression(cell))
+                    continue
+
+                if not workers:
+                    setup = SUBINTERPRETER_SETUP.format(
+                        directory=os.path.dirname(os.path.abspath(__file__)),
+                        module=os.path.splitext(os.path.basename(__file__))[0],
+                    )
+                    for _ in range(self.workers):
+                        interpreter = interpreters.create()
+                        workers.append(interpreter)
+                        interpreter.prepare_main(
+                            values=memoryview(self.values), state=memoryview(self.cellState),
+                            codeStart=memoryview(self.codeStart), codeEnd=memoryview(self.codeEnd),
+                            opcodes=memoryview(self.opcodes), operands=memoryview(self.operands),
+                            constants=memoryview(self.constants), order=memoryview(order),
+                        )
+                        interpreter.exec(setup)
+
+                sliceSize = -(-len(level) // len(workers))
+                threads = [
+                    threading.Thread(target=run, args=(
+                        interpreter,
+                        f"spreadsheetModule.evaluateParallelBatch(order[{sliceStart}:{min(sliceStart + sliceSize, end)}])",
+                    ))
+                    for interpreter, sliceStart in zip(workers, range(start, end, sliceSize))
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                if failures:
+                    raise failures[0]
+        finally:
+            for interpreter in workers:
+                interpreter.close()
+
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
+
+    '''
+    Returns a cell's formula template: its code with every reference made relative to the cell (R1C1 style),
+        e.g. C5 = A5 B5 * and C6 = A6 B6 * share a template. Numeric literals are left out, so they may differ
+        between cells of a template.
+
+    Returns None for cells referencing outside the grid, which are left to be evaluated on their own
+
+    cellRows maps each cell ID to its row index
+    '''
+    def getTemplate(self, cellId, cellRows):
+        rowStart = self.rowStart
+        opcodes = self.opcodes
+        operands = self.operands
+        rowIndex = cellRows[cellId]
+        colIndex = cellId - rowStart[rowIndex]
+
+        template = []
+        for pc in range(self.codeStart[cellId], self.codeEnd[cellId]):
+            opcode = opcodes[pc]
+            if opcode == PUSH_REF:
+                ref = operands[pc]
+                if ref == OUT_OF_GRID:
+                    return None
+                refRow = cellRows[ref]
+                template.append((PUSH_REF, refRow - rowIndex, ref - rowStart[refRow] - colIndex))
+            else:
+                template.append(opcode)
+        return tuple(template)
+
+    '''
+    Groups the cells of each topological level by formula template (see getTemplate)
+
+    Cells within a level never depend on each other, so each group can be evaluated all at once
+    '''
+    def buildTemplates(self):
+        if self.levels is None:
+            self.buildLevels()
+
+        cellRows = array('q')
+        for rowIndex in range(len(self.rowStart) - 1):
+            cellRows.extend([rowIndex] * (self.rowStart[rowIndex + 1] - self.rowStart[rowIndex]))
+
+        templateGroups = []
+        for level in self.levels:
+            groups = {}
+            for cell in level:
+                groups.setdefault(self.getTemplate(cell, cellRows), []).append(cell)
+            templateGroups.append(groups)
+
+        self.templateGroups = templateGroups
+
+    '''
+    Vectorized evaluation engine; evaluates each group of cells sharing a formula template with NumPy, level by level
+
+    Each reference or literal position of a template becomes an array gathered across the group's cells (with
+        a matching array of cell states), and each operator becomes a single NumPy operation. Cell states are
+        combined with the same rules as the scalar engines, so error values and empty cells behave identically.
+        Small groups, and cells without a template, are evaluated cell by cell (see MIN_TEMPLATE_GROUP_SIZE).
+
+    Without NumPy this falls back to the topological engine. As with the topological engine, cells left out of the
+        order are handed to evaluateCyclicCells, which marks the cycles
+    '''
+    def evaluateVectorized(self):
+        if numpy is None:
+            self.evaluateTopological()
+            return
+
+        if self.templateGroups is None:
+            self.buildTemplates()
+
+        for groups in self.templateGroups:
+            for template, cells in groups.items():
+                if template is None or len(cells) < MIN_TEMPLATE_GROUP_SIZE:
+                    for cell in cells:
+                        self.setValue(cell, self.evaluateExpression(cell))
+                else:
+                    self.evaluateTemplateGroup(template, cells)
+
+        if len(self.topoOrder) < len(self.precedents):
+            self.evaluateCyclicCells()
+
+    '''
+    Evaluates a group of cells sharing a formula template with one NumPy operation per template position
+    '''
+    def evaluateTemplateGroup(self, template, cells):
+        values = numpy.frombuffer(self.values, dtype=numpy.float64)
+        cellState = numpy.frombuffer(self.cellState, dtype=numpy.uint8)
+        starts = numpy.frombuffer(self.codeStart, dtype=numpy.int64)[cells]
+        operands = numpy.frombuffer(self.operands, dtype=numpy.int64)
+        constants = numpy.frombuffer(self.constants, dtype=numpy.float64)
+        queue = deque()
+
+        with numpy.errstate(all="ignore"):
+            for position, instruction in enumerate(template):
+                if instruction == PUSH_CONST:
+                    operand = constants[operands[starts + position]]
+                    queue.append((operand, numpy.full(len(cells), NUMBER, dtype=numpy.uint8)))
+                elif type(instruction) is tuple: # PUSH_REF
+                    refs = operands[starts + position]
+                    queue.append((values[refs], cellState[refs]))
+                else:
+                    a, aState = queue.popleft()
+                    b, bState = queue.popleft()
+                    queue.append(self.calculateVectorized(a, aState, b, bState, instruction))
+
+        result, resultState = queue.pop()
+        values[cells] = result
+        cellState[cells] = resultState
+
+    '''
+    Vectorized form of calculate: applies an operator to arrays of operands and their cell states
+
+    Follows the same rules as the error and empty operands of the scalar engines: an error in the first operand
+        wins, then an error in the second, then an empty operand gives #VALUE!, then division by zero gives #DIV/0!
+    '''
+    def calculateVectorized(self, a, aState, b, bState, operator):
+        if operator == ADD:
+            res = a + b
+        elif operator == SUB:
+            res = a - b
+        elif operator == MUL:
+            res = a * b
+        elif operator == DIV:
+            res = a / b
+
+        resState = numpy.full(len(res), NUMBER, dtype=numpy.uint8)
+        if operator == DIV:
+            resState[(b == 0) & (aState == NUMBER) & (bState == NUMBER)] = ERROR_DIV0
+        resState[(aState == EMPTY) | (bState == EMPTY)] = ERROR_VALUE
+        bError = bState >= ERROR_DIV0
+        resState[bError] = bState[bError]
+        aError = aState >= ERROR_DIV0
+        resState[aError] = aState[aError]
+        return res, resState
 
     '''
-    Performs calculation on operands in the queue using the given operator
+    Performs calculation on operands in the queue using the given operator (ADD, SUB, MUL or DIV)
+
+    Operands that are error values or empty give an error value (see CellError and EmptyOperand)
     '''
-    def calculate(self, a, b, operator): # FIXME: change back to queue type
-        if operator == "+":
+    def calculate(self, a, b, operator):
+        if operator == ADD:
             res = a + b
-        elif operator == "-":
+        elif operator == SUB:
             res = a - b
-        elif operator == "*":
+        elif operator == MUL:
             res = a * b
-        elif operator == "/":
-            if b == 0:
-                raise Exception("Division by zero")
+        elif operator == DIV:
+            if b == 0 and type(a) is float:
+                return ERROR_VALUES[ERROR_DIV0]
             res = a / b
         return res
 
@@ -200,34 +2797,101 @@ class SpreadsheetEval:
     '''
     def writeOutput(self):
             with open(self.outputFile, 'w') as out:
-                for row in self.grid:
+                rowStart = self.rowStart
+                for rowIndex in range(len(rowStart) - 1):
                     cells = []
-                    for cell in row:
-                        cells.append(str(self.valMap[cell]))
+                    for cellId in range(rowStart[rowIndex], rowStart[rowIndex + 1]):
+                        cells.append(str(self.getValue(cellId)))
                     out.write(",".join(cells) + "\n")
+
+    '''
+    Writes the results of the given cells (see evaluateCells) to the output file, one "name,value" line per cell
+    '''
+    def writeCellOutput(self, names, values):
+        with open(self.outputFile, 'w') as out:
+            for name, value in zip(names, values):
+                out.write(f"{name},{value}\n")
     
 def main():
     
     # Checks args to ensure usage is correct
-    if len(sys.argv) != 3:
-        print("Invalid usage.\npython3 SpreadsheetEvaluator.py <inputfile> <outputfile>")
-        return
+    parser = argparse.ArgumentParser(usage="python3 SpreadsheetEvaluator.py <inputfile> <outputfile> [--engine ENGINE] [--workers N] [--parallel-parse]\n       [--iterate] [--max-iterations N] [--max-change X] [--cells CELLS] [--save-snapshot FILE] [--from-snapshot]\n       [--plan-cache DIR]")
+    parser.add_argument("inputfile")
+    parser.add_argument("outputfile")
+    parser.add_argument("--engine", choices=ENGINES, default="iterative", help="evaluation engine (default: iterative)")
+    parser.add_argument("--workers", type=int, help="number of workers (processes, threads or interpreters) for the parallel, sharded, threaded and subinterpreters engines and --parallel-parse (default: CPU count)")
+    parser.add_argument("--parallel-parse", action="store_true", help="parse the input file across --workers processes")
+    parser.add_argument("--iterate", action="store_true", help="calculate circular references iteratively instead of marking them #CYCLE!")
+    parser.add_argument("--max-iterations", type=int, metavar="N", help="most sweeps over a circular reference with --iterate (default: 100)")
+    parser.add_argument("--max-change", type=float, metavar="X", help="largest change at which --iterate stops sweeping (default: 0.001)")
+    parser.add_argument("--save-snapshot", metavar="FILE", help="save the compiled sheet to a binary snapshot for fast reloading")
+    parser.add_argument("--from-snapshot", action="store_true", help="read the input file as a snapshot saved by --save-snapshot")
+    parser.add_argument("--plan-cache", metavar="DIR", help="reuse evaluation plans cached in DIR for sheets that differ only in their numbers")
+    parser.add_argument("--cells", help="comma-separated cells to evaluate and write (e.g. C10,Z500), instead of the whole sheet")
+    args = parser.parse_args()
     
-    spreadsheetEvaluator = SpreadsheetEval(sys.argv[1], sys.argv[2])
+    spreadsheetEvaluator = SpreadsheetEval(args.inputfile, args.outputfile)
+    spreadsheetEvaluator.engine = args.engine
+    if args.workers:
+        spreadsheetEvaluator.workers = args.workers
+    spreadsheetEvaluator.parallelParsing = args.parallel_parse
+    spreadsheetEvaluator.iterativeCalculation = args.iterate
+    if args.max_iterations is not None:
+        spreadsheetEvaluator.maxIterations = args.max_iterations
+    if args.max_change is not None:
+        spreadsheetEvaluator.maxChange = args.max_change
+    cells = [name.strip() for name in args.cells.split(",")] if args.cells else None
+    spreadsheetEvaluator.lazyParsing = cells is not None and not args.save_snapshot
+    # Requested cells are always evaluated by walking their precedents, as the "iterative" engine does
+    if args.cells and (args.engine != "iterative" or args.plan_cache):
+        parser.error("--cells always evaluates with the iterative walk, so it takes neither --engine nor --plan-cache")
+    if args.plan_cache and args.engine in CELL_ENGINES and not args.iterate:
+        parser.error(f"--plan-cache needs an engine that builds a plan, not '{args.engine}' (e.g. --engine topological)")
+    if args.plan_cache:
+        spreadsheetEvaluator.usePlanCache = True
+        spreadsheetEvaluator.planCacheDir = args.plan_cache
 
     try:
-        print("Parsing input...\n")
-        spreadsheetEvaluator.parseInput()
+        if args.from_snapshot:
+            print("Loading snapshot...\n")
+            spreadsheetEvaluator.loadSnapshot(args.inputfile)
+        else:
+            print("Parsing input...\n")
+            spreadsheetEvaluator.parseInput()
+
+        if args.save_snapshot:
+            print(f"Saving snapshot to {args.save_snapshot}...\n")
+            spreadsheetEvaluator.saveSnapshot(args.save_snapshot)
 
         print("Evaluating cell expressions...\n")
-        spreadsheetEvaluator.evaluate()
+        if cells:
+            values = spreadsheetEvaluator.evaluateCells(cells)
+        else:
+            spreadsheetEvaluator.evaluate()
+
+        # Errors are reported per cell; the rest of the sheet is still written out
+        errors = spreadsheetEvaluator.getErrors()
+        for cellId, message in errors[:MAX_REPORTED_ERRORS]:
+            print("Error: ", message)
+        if len(errors) > MAX_REPORTED_ERRORS:
+            print(f"... and {len(errors) - MAX_REPORTED_ERRORS} more errors")
+        if errors:
+            print()
 
-        print(f"Writing to {sys.argv[2]}...\n")
-        spreadsheetEvaluator.writeOutput()
+        print(f"Writing to {args.outputfile}...\n")
+        if cells:
+            spreadsheetEvaluator.writeCellOutput(cells, values)
+        else:
+            spreadsheetEvaluator.writeOutput()
 
-        print("Spreadsheet successfully evaluated and tabulated.\n")
+        if errors:
+            print("Spreadsheet evaluated and tabulated with errors.\n")
+        else:
+            print("Spreadsheet successfully evaluated and tabulated.\n")
     except Exception as e:
         print("Error: ", e)
+    finally:
+        spreadsheetEvaluator.close()
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -1,7 +1,11 @@
+import os
 import subprocess
 import tempfile
 import unittest
 
+import SpreadsheetEvaluator
+from SpreadsheetEvaluator import SpreadsheetEval, ENGINES
+
 outputTests = [
     {
         "test": "Basic arithmetic",
@@ -32,6 +36,46 @@ outputTests = [
         "test": "Reference with arithmetic",
         "input": "2,\nA1 3 +",
         "expected": "2.0,\n5.0"
+    },
+    {
+        "test": "References outside the grid",
+        "input": "1,2\nB1,C1,A9",
+        "expected": "1.0,2.0\n2.0,#REF!,#REF!"
+    },
+    {
+        "test": "Multi-letter column references",
+        "input": ",".join(str(i) for i in range(1, 28)) + "\nAA1 Z1 -",
+        "expected": ",".join(f"{float(i)}" for i in range(1, 28)) + "\n1.0"
+    },
+    {
+        "test": "Error values",
+        "input": "1 0 /,A1 1 +,3\n2 3 & +,A2,C1 2 *",
+        "expected": "#DIV/0!,#DIV/0!,3.0\n#PARSE!,#PARSE!,6.0"
+    },
+    {
+        "test": "Circular references",
+        "input": "A2,1\nA1,B1\nA2 1 +,A3",
+        "expected": "#CYCLE!,1.0\n#CYCLE!,1.0\n#CYCLE!,#CYCLE!"
+    },
+    {
+        "test": "Empty cell as an operand",
+        "input": ",A1 1 +,A1",
+        "expected": ",#VALUE!,"
+    },
+    {
+        "test": "Line endings and whitespace",
+        "input": "1,\t2 \r\nA1 B1 +,A01 1 +\rB2 2 *",
+        "expected": "1.0,2.0\n3.0,2.0\n4.0"
+    },
+    {
+        "test": "Non-ASCII characters",
+        "input": "1,\u00c41 1 +,1 \uff12 +\nA1\u00a0B1 +",
+        "expected": "1.0,#REF!,3.0\n#REF!"
+    },
+    {
+        "test": "Reference chain deeper than recursion limit",
+        "input": "\n".join([f"A{i + 1} 1 +" for i in range(1, 5000)] + ["1"]),
+        "expected": "\n".join(f"{float(i)}" for i in range(5000, 0, -1))
     }
 ]
 
@@ -80,6 +124,506 @@ class SpreadsheetEvaluatorTest(unittest.TestCase):
                     output = f.read().strip()
                 self.assertEqual(output, test["expected"].strip())
  
+    def testEngines(self):
+        for engine in ENGINES:
+            for test in outputTests:
+                if engine == "recursive" and "recursion limit" in test["test"]:
+                    continue
+                with self.subTest(engine=engine, test=test["test"]):
+                    inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+                    inputFile.write(test["input"])
+                    inputFile.close()
+
+                    outputFile = tempfile.NamedTemporaryFile(mode="r", delete=False)
+                    outputFile.close()
+
+                    spreadsheetEvaluator = SpreadsheetEval(inputFile.name, outputFile.name)
+                    spreadsheetEvaluator.engine = engine
+                    spreadsheetEvaluator.parseInput()
+                    spreadsheetEvaluator.evaluate()
+                    spreadsheetEvaluator.writeOutput()
+
+                    with open(outputFile.name, "r") as f:
+                        output = f.read().strip()
+                    self.assertEqual(output, test["expected"].strip())
+
+    def testConstantFolding(self):
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("2 3 +,4,A1 B1 *\n1 0 /,-1.5")
+        inputFile.close()
+
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.parseInput()
+
+        # Only the cell with references is left to evaluate
+        self.assertEqual(spreadsheetEvaluator.formulaCells(), [2])
+        self.assertEqual(spreadsheetEvaluator.getValue(0), 5.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(1), 4.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(3), "#DIV/0!")
+        self.assertEqual(spreadsheetEvaluator.getValue(4), -1.5)
+
+    def testParallelEngines(self):
+        # Many independent rows, each referencing a shared input, plus a second level summing neighbouring rows
+        # and a third column of small independent chains
+        rows = ["2"] + [f"A1 {i} *,A{i + 2} B{i + 1} +,{i},C{i + 1} D{i + 1} +" for i in range(1, 2000)]
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("\n".join(rows))
+        inputFile.close()
+
+        outputs = {}
+        for engine in ["iterative", "parallel", "sharded", "workStealing"]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.engine = engine
+            spreadsheetEvaluator.workers = 2
+            spreadsheetEvaluator.minParallelCells = 1
+            spreadsheetEvaluator.parseInput()
+            if engine == "workStealing": # Runs the scheduler even where the threaded engine would fall back to serial
+                spreadsheetEvaluator.evaluateWorkStealing()
+            else:
+                spreadsheetEvaluator.evaluate()
+            outputs[engine] = [spreadsheetEvaluator.getValue(cellId) for cellId in range(len(spreadsheetEvaluator.cellState))]
+
+        self.assertEqual(outputs["parallel"], outputs["iterative"])
+        self.assertEqual(outputs["sharded"], outputs["iterative"])
+        self.assertEqual(outputs["workStealing"], outputs["iterative"])
+
+    def testParallelParsing(self):
+        # Row ranges mixing line endings, text-only rows, parse errors, folded constants and references across ranges
+        rows = ["1,2\r\nA1 B1 +,A01 1 +\rB2 2 *,\u00c41 1 +", "1 0 /,A1 A2 + C9 -,1 2 + 3 *"]
+        rows += [f"A{i - 1} 1 +,1 2,B{i + 1} A1 *" for i in range(4, 400)] + ["1"]
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False, newline="")
+        inputFile.write("\n".join(rows))
+        inputFile.close()
+
+        outputs = {}
+        for parallelParsing in [False, True]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.parallelParsing = parallelParsing
+            spreadsheetEvaluator.workers = 2
+            spreadsheetEvaluator.minParallelCells = 1
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+            outputs[parallelParsing] = ([spreadsheetEvaluator.getValue(cellId) for cellId in range(len(spreadsheetEvaluator.cellState))],
+                                        spreadsheetEvaluator.getErrors())
+
+        self.assertEqual(outputs[True], outputs[False])
+
+    def testLazyParsing(self):
+        # Row 3 only needs rows 1 and 2; rows 4 and up are never parsed
+        rows = ["1,2", "A1 B1 +,5", "A2 B2 *"] + [f"A{i - 1} 1 +,1 0 /" for i in range(4, 100)]
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("\n".join(rows))
+        inputFile.close()
+
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.lazyParsing = True
+        spreadsheetEvaluator.parseInput()
+        self.assertEqual(spreadsheetEvaluator.evaluateIterative(4), 15.0)
+        self.assertEqual(list(spreadsheetEvaluator.parsedRows[:4]), [1, 1, 1, 0])
+        self.assertEqual(sum(spreadsheetEvaluator.parsedRows), 3)
+
+        # Evaluating the whole sheet parses the rest
+        spreadsheetEvaluator.evaluate()
+        self.assertEqual(spreadsheetEvaluator.getValue(5), 16.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(6), "#DIV/0!")
+        self.assertEqual(sum(spreadsheetEvaluator.parsedRows), len(rows))
+        self.assertIsNone(spreadsheetEvaluator.inputData) # Released once every row is parsed
+
+        # An explicit close() releases the input file early
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.lazyParsing = True
+        spreadsheetEvaluator.parseInput()
+        self.assertEqual(spreadsheetEvaluator.evaluateIterative(4), 15.0)
+        mapping = spreadsheetEvaluator.inputData
+        spreadsheetEvaluator.close()
+        self.assertTrue(mapping.closed)
+        self.assertIsNone(spreadsheetEvaluator.inputData)
+
+    def testEvaluateCells(self):
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("1,2\nA1 B1 +,A2 2 *\n1 0 /,A2 1 +")
+        inputFile.close()
+
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.lazyParsing = True
+        spreadsheetEvaluator.parseInput()
+        self.assertEqual(spreadsheetEvaluator.evaluateCells(["B2", "A3"]), [6.0, "#DIV/0!"])
+        self.assertIsNone(spreadsheetEvaluator.getValue(5)) # B3 was not asked for
+        with self.assertRaises(Exception):
+            spreadsheetEvaluator.evaluateCells(["C1"])
+
+        # Only the requested cells are written
+        outputFile = tempfile.NamedTemporaryFile(mode="r", delete=False)
+        outputFile.close()
+        subprocess.run(["python3", "SpreadsheetEvaluator.py", inputFile.name, outputFile.name, "--cells", "B2,A2"], capture_output=True, text=True)
+        with open(outputFile.name, "r") as f:
+            self.assertEqual(f.read(), "B2,6.0\nA2,3.0\n")
+
+        # Other engines and the plan cache do not apply to --cells
+        for flags in [["--engine", "topological"], ["--plan-cache", tempfile.gettempdir()]]:
+            result = subprocess.run(["python3", "SpreadsheetEvaluator.py", inputFile.name, outputFile.name, "--cells", "B2"] + flags, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("--cells always evaluates with the iterative walk", result.stderr)
+
+        # Cells in or depending on cycles that the walk from a single cell only partly closes, with and without
+        # iterative calculation; each cell on its own must match the whole sheet
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("C3 C2 +,F5 C1 +,B4,D3 E3 +,F4 B5 +\n1,5,F2 C5 +,5,C4 A5 +\nD5,3,C1 D3 +,F3 A4 +,A4 B1 +\n"
+                        "B5 C1 +,2,4,E5 B3 +,C3 B3 +\n4,C3 A1 +,C1 D3 +,A2 C3 +,5")
+        inputFile.close()
+
+        for iterate in [False, True]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.iterativeCalculation = iterate
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+            for cellId in range(25):
+                name = spreadsheetEvaluator.getCellNameById(cellId)
+                cellEvaluator = SpreadsheetEval(inputFile.name, None)
+                cellEvaluator.iterativeCalculation = iterate
+                cellEvaluator.lazyParsing = True
+                cellEvaluator.parseInput()
+                with self.subTest(iterate=iterate, cell=name):
+                    self.assertEqual(cellEvaluator.evaluateCells([name]), [spreadsheetEvaluator.getValue(cellId)])
+
+    def testSnapshot(self):
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("1,2,A1 B1 + 2 *\nC1 B1 -,1 0 /,3 & 4\nB3,A3,C3 1 +")
+        inputFile.close()
+        snapshotFile = tempfile.NamedTemporaryFile(delete=False)
+        snapshotFile.close()
+
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.saveSnapshot(snapshotFile.name)
+        spreadsheetEvaluator.evaluate()
+        expected = ([spreadsheetEvaluator.getValue(cellId) for cellId in range(9)], spreadsheetEvaluator.getErrors())
+
+        for engine in ["iterative", "topological", "codegen", "sharded", "threaded", "vectorized", "shared", "affine", "linear"]:
+            loadedEvaluator = SpreadsheetEval(None, None)
+            loadedEvaluator.engine = engine
+            loadedEvaluator.loadSnapshot(snapshotFile.name)
+            loadedEvaluator.evaluate()
+            self.assertEqual(([loadedEvaluator.getValue(cellId) for cellId in range(9)], loadedEvaluator.getErrors()), expected)
+
+        # The loaded dependency graph is complete enough for incremental edits
+        loadedEvaluator.setCell("A1", "5")
+        loadedEvaluator.recalculate()
+        self.assertEqual(loadedEvaluator.getValue(2), 14.0)
+        self.assertEqual(loadedEvaluator.getValue(3), 12.0)
+
+        with self.assertRaises(Exception):
+            SpreadsheetEval(None, None).loadSnapshot(inputFile.name)
+
+        # A truncated snapshot is refused as such
+        with open(snapshotFile.name, "rb") as f:
+            data = f.read()
+        with open(snapshotFile.name, "wb") as f:
+            f.write(data[:len(data) // 2])
+        with self.assertRaisesRegex(Exception, "not a spreadsheet snapshot"):
+            SpreadsheetEval(None, None).loadSnapshot(snapshotFile.name)
+
+    def testPlanCache(self):
+        # Same structure, different literals and plain numbers; the third sheet's literals repeat differently
+        sheets = [
+            "1,2,A1 B1 + 2 *\nC1 B1 -,A2 3 /,A1 B1 + 4 *",
+            "7,-4,A1 B1 + 5 *\nC1 B1 -,A2 0 /,A1 B1 + 1 *",
+            "1,2,A1 B1 + 2 *\nC1 B1 -,A2 3 /,A1 B1 + 2 *",
+        ]
+        inputFiles = []
+        for sheet in sheets:
+            inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+            inputFile.write(sheet)
+            inputFile.close()
+            inputFiles.append(inputFile.name)
+        planCacheDir = tempfile.mkdtemp()
+
+        for engine in ["codegen", "vectorized", "sharded"]:
+            hashes = []
+            for inputFile in inputFiles:
+                expectedEvaluator = SpreadsheetEval(inputFile, None)
+                expectedEvaluator.parseInput()
+                expectedEvaluator.evaluate()
+
+                spreadsheetEvaluator = SpreadsheetEval(inputFile, None)
+                spreadsheetEvaluator.engine = engine
+                spreadsheetEvaluator.usePlanCache = True
+                spreadsheetEvaluator.planCacheDir = planCacheDir
+                spreadsheetEvaluator.parseInput()
+                spreadsheetEvaluator.evaluate()
+                hashes.append(spreadsheetEvaluator.structureHash)
+                with self.subTest(engine=engine, inputFile=inputFile):
+                    self.assertEqual([spreadsheetEvaluator.getValue(cellId) for cellId in range(6)],
+                                     [expectedEvaluator.getValue(cellId) for cellId in range(6)])
+            self.assertEqual(hashes[0], hashes[1])
+            self.assertNotEqual(hashes[0], hashes[2])
+
+        # A fresh process only finds the plans on disk; the restored plan skips building the graph and generating code
+        SpreadsheetEvaluator.cachedPlans.clear()
+        spreadsheetEvaluator = SpreadsheetEval(inputFiles[1], None)
+        spreadsheetEvaluator.usePlanCache = True
+        spreadsheetEvaluator.planCacheDir = planCacheDir
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.restorePlan()
+        self.assertIsNotNone(spreadsheetEvaluator.topoOrder)
+        self.assertIsNotNone(spreadsheetEvaluator.generatedCode)
+        self.assertIsNotNone(spreadsheetEvaluator.templateGroups)
+        spreadsheetEvaluator.engine = "codegen"
+        spreadsheetEvaluator.evaluate()
+        self.assertEqual(spreadsheetEvaluator.getValue(2), 15.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(4), "#DIV/0!")
+        self.assertEqual(spreadsheetEvaluator.getValue(5), 3.0)
+
+        # The default engine has no plan to cache, so the cache is skipped, and refused on the command line
+        spreadsheetEvaluator = SpreadsheetEval(inputFiles[0], None)
+        spreadsheetEvaluator.usePlanCache = True
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.evaluate()
+        self.assertIsNone(spreadsheetEvaluator.structureHash)
+        result = subprocess.run(["python3", "SpreadsheetEvaluator.py", inputFiles[0], os.devnull, "--plan-cache", planCacheDir], capture_output=True, text=True)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("--plan-cache needs an engine", result.stderr)
+
+    def testVectorizedEngine(self):
+        # Rows sharing templates, with literals varying per row, zero divisors, empty cells and error operands
+        rows = [f"{i % 3},,{i} A{i} /,B{i} 1 +,C{i} A{i} - 2 *,E{i} C{i} +,Z{i}" for i in range(1, 200)]
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("\n".join(rows))
+        inputFile.close()
+
+        outputs = {}
+        for engine in ["iterative", "vectorized"]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.engine = engine
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+            outputs[engine] = [spreadsheetEvaluator.getValue(cellId) for cellId in range(len(spreadsheetEvaluator.cellState))]
+
+        self.assertEqual(outputs["vectorized"], outputs["iterative"])
+
+    def testSharedExpressions(self):
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("1,2,0\nA1 B1 + 2 *,A1 B1 + 2 *,A1 B1 + C1 /\nA2 B2 +,A1 B1 + -0 *,A1 B1 + 0 *")
+        inputFile.close()
+
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.engine = "shared"
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.evaluate()
+
+        # Identical expressions share code, and A1 B1 + is a single node
+        self.assertEqual(spreadsheetEvaluator.codeStart[3], spreadsheetEvaluator.codeStart[4])
+        self.assertEqual(list(spreadsheetEvaluator.byteExpressionIndex), [b"A1 B1 + 2 *", b"A1 B1 + C1 /", b"A2 B2 +", b"A1 B1 + -0 *", b"A1 B1 + 0 *"])
+        self.assertEqual(len(spreadsheetEvaluator.nodeOpcodes), 14)
+        self.assertEqual([spreadsheetEvaluator.getValue(cellId) for cellId in range(3, 9)],
+                         [6.0, 6.0, "#DIV/0!", 12.0, -0.0, 0.0])
+
+    def testAffineChains(self):
+        # Chains of affine cells over a number, an empty cell, an error and a plain reference, with non-affine
+        # cells reading from and feeding into them; integer data, so the closed forms are exact
+        rows = ["3,,1 0 /,A1 A1 *"] + [f"A{i} 1 +,B{i},C{i} 2 * 1 -,2 D{i} 2 * - 2 /" for i in range(1, 300)]
+        rows.append("A300 B300 +,A300 C1 +,A300 D300 *,D300")
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("\n".join(rows))
+        inputFile.close()
+
+        outputs = {}
+        for engine in ["iterative", "affine"]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.engine = engine
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+            outputs[engine] = [spreadsheetEvaluator.getValue(cellId) for cellId in range(len(spreadsheetEvaluator.cellState))]
+
+        self.assertEqual(outputs["affine"], outputs["iterative"])
+
+        # Chains whose composed scale overflows (2**1199 times 0) or underflows (2**-1199 times a 190-digit number)
+        for rows in [["0"] + [f"A{i} 2 *" for i in range(1, 1200)], ["9" * 190] + [f"A{i} 2 /" for i in range(1, 1200)]]:
+            inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+            inputFile.write("\n".join(rows))
+            inputFile.close()
+
+            outputs = {}
+            for engine in ["iterative", "affine"]:
+                spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+                spreadsheetEvaluator.engine = engine
+                spreadsheetEvaluator.parseInput()
+                spreadsheetEvaluator.evaluate()
+                outputs[engine] = [spreadsheetEvaluator.getValue(cellId) for cellId in range(len(spreadsheetEvaluator.cellState))]
+
+            with self.subTest(first=rows[0][:10]):
+                self.assertEqual(outputs["affine"], outputs["iterative"])
+
+    def testLinearSystem(self):
+        # A financial-style rollup: line items, scaled subtotals and a running total
+        rows = [f"{i},{i} 2 *,A{i} B{i} + 4 /,D{i - 1} C{i} + 10 -" if i > 1 else "1,2,A1 B1 + 4 /,C1" for i in range(1, 500)]
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("\n".join(rows))
+        inputFile.close()
+
+        outputs = {}
+        for engine in ["iterative", "linear"]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.engine = engine
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+            outputs[engine] = [spreadsheetEvaluator.getValue(cellId) for cellId in range(len(spreadsheetEvaluator.cellState))]
+
+        self.assertTrue(spreadsheetEvaluator.linearSystem)
+        self.assertEqual(outputs["linear"], outputs["iterative"])
+
+        # Sheets with non-linear formulas, error inputs or infinite values are left to the topological engine
+        for sheet in ["2,A1 A1 *", f"{'9' * 308},A1 100 *", f"{'9' * 308},A1 100 *,B1 B1 -", "1 0 /,A1 2 *"]:
+            inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+            inputFile.write(sheet)
+            inputFile.close()
+
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.engine = "linear"
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+            self.assertFalse(spreadsheetEvaluator.linearSystem)
+        self.assertEqual(spreadsheetEvaluator.getValue(1), "#DIV/0!")
+
+        # Values overflowing while solving, which terms folded together (B1 B1 -, C1 0 *) would turn into zeros
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write(f"1{'0' * 307},A1 10 *,B1 10 *,C1 C1 -,C1 0 *")
+        inputFile.close()
+
+        outputs = {}
+        for engine in ["iterative", "linear"]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.engine = engine
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+            outputs[engine] = [str(spreadsheetEvaluator.getValue(cellId)) for cellId in range(5)]
+
+        self.assertEqual(outputs["linear"], outputs["iterative"])
+        self.assertEqual(outputs["linear"][2:], ["inf", "nan", "nan"])
+
+    def testCycleReporting(self):
+        # A ring of 12 cells down column A, a two-cell cycle (B1 and B2) with a cell depending on it (C2),
+        # a self-reference (C1) and cells that are fine (D1 and D2)
+        rows = ["A2,B2 1 +,C1,5", "A3,B1,B2 1 +,D1 1 +"] + [f"A{i % 12 + 1}" for i in range(3, 13)]
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("\n".join(rows))
+        inputFile.close()
+
+        for engine in ["iterative", "topological"]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.engine = engine
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluate()
+
+            messages = [message for cellId, message in spreadsheetEvaluator.getErrors()]
+            self.assertEqual(messages, [
+                "Circular reference at A1 (cycle of 12 cells: A1, A2, A3, A4, A5, A6, A7, A8, A9, A10 and 2 more)",
+                "Circular reference at B1 (cycle of 2 cells: B1, B2)",
+                "Circular reference at C1"
+            ])
+            self.assertEqual(spreadsheetEvaluator.getValue(6), "#CYCLE!")
+            self.assertEqual(spreadsheetEvaluator.getValue(12), "#CYCLE!")
+            self.assertEqual(spreadsheetEvaluator.getValue(7), 6.0)
+
+    def testIterativeCalculation(self):
+        # A deliberate cycle (A1 and B1) with a cell depending on it, and a cycle that never converges (A2)
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("B1 0.5 * 10 +,A1 0.5 *,A1 B1 +\nA2 1 +,1,A2 B2 +")
+        inputFile.close()
+
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.iterativeCalculation = True
+        spreadsheetEvaluator.maxChange = 1e-9
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.evaluate()
+
+        self.assertAlmostEqual(spreadsheetEvaluator.getValue(0), 40 / 3)
+        self.assertAlmostEqual(spreadsheetEvaluator.getValue(1), 20 / 3)
+        self.assertAlmostEqual(spreadsheetEvaluator.getValue(2), 20.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(3), 100.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(5), 101.0)
+
+        # Without iterative calculation, the cycles are still errors
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.evaluate()
+        self.assertEqual(spreadsheetEvaluator.getValue(0), "#CYCLE!")
+        self.assertEqual(spreadsheetEvaluator.getValue(3), "#CYCLE!")
+
+    def testIncrementalRecalculation(self):
+        inputFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        inputFile.write("1,2,5\nA1 B1 +,A2 2 *,C1")
+        inputFile.close()
+
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.evaluate()
+
+        # Only the dependents of A1 are evaluated again
+        spreadsheetEvaluator.setCell("A1", "10")
+        self.assertEqual(spreadsheetEvaluator.recalculate(), [3, 4])
+        self.assertEqual(spreadsheetEvaluator.getValue(3), 12.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(4), 24.0)
+        self.assertEqual(spreadsheetEvaluator.getValue(5), 5.0)
+
+        spreadsheetEvaluator.setCell("A1", "B2")
+        spreadsheetEvaluator.recalculate()
+        self.assertEqual([spreadsheetEvaluator.getValue(cellId) for cellId in (0, 3, 4)], ["#CYCLE!"] * 3)
+
+        spreadsheetEvaluator.setCell("A1", "C2 1 +")
+        spreadsheetEvaluator.recalculate()
+        self.assertEqual([spreadsheetEvaluator.getValue(cellId) for cellId in (0, 3, 4)], [6.0, 8.0, 16.0])
+
+        # An edit closing a cycle next to a formula cell that is not evaluated again
+        cycleFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        cycleFile.write("C1,A1 1 +,5")
+        cycleFile.close()
+        cycleEvaluator = SpreadsheetEval(cycleFile.name, None)
+        cycleEvaluator.parseInput()
+        cycleEvaluator.evaluate()
+        cycleEvaluator.setCell("B1", "A1 B1 +")
+        self.assertEqual(cycleEvaluator.recalculate(), [1])
+        self.assertEqual([cycleEvaluator.getValue(cellId) for cellId in range(3)], [5.0, "#CYCLE!", 5.0])
+
+        # With iterative calculation, an edit inside a cycle is iterated again rather than marked #CYCLE!
+        cycleFile = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        cycleFile.write("B1 0.5 * 10 +,A1 0.5 *,A1 B1 +")
+        cycleFile.close()
+        cycleEvaluator = SpreadsheetEval(cycleFile.name, None)
+        cycleEvaluator.iterativeCalculation = True
+        cycleEvaluator.parseInput()
+        cycleEvaluator.evaluate()
+        cycleEvaluator.setCell("A1", "B1 0.5 * 20 +")
+        cycleEvaluator.recalculate()
+        values = [cycleEvaluator.getValue(cellId) for cellId in range(3)]
+        self.assertAlmostEqual(values[0], 80 / 3, delta=0.01)
+        self.assertAlmostEqual(values[1], 40 / 3, delta=0.01)
+        self.assertEqual(values[2], values[0] + values[1])
+
+        # Precedents not evaluated yet, after evaluating only some cells or nothing at all
+        for evaluated in [["A1"], []]:
+            spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+            spreadsheetEvaluator.parseInput()
+            spreadsheetEvaluator.evaluateCells(evaluated)
+            spreadsheetEvaluator.setCell("C1", "B2 1 +")
+            spreadsheetEvaluator.recalculate()
+            self.assertEqual([spreadsheetEvaluator.getValue(cellId) for cellId in (2, 5)], [7.0, 7.0])
+
+        # Editing a number keeps the generated code, while editing references rebuilds it
+        spreadsheetEvaluator = SpreadsheetEval(inputFile.name, None)
+        spreadsheetEvaluator.engine = "codegen"
+        spreadsheetEvaluator.parseInput()
+        spreadsheetEvaluator.evaluate()
+        generatedCode = spreadsheetEvaluator.generatedCode
+        spreadsheetEvaluator.setCell("B1", "3")
+        self.assertIs(spreadsheetEvaluator.generatedCode, generatedCode)
+        spreadsheetEvaluator.evaluate()
+        self.assertEqual([spreadsheetEvaluator.getValue(cellId) for cellId in (3, 4)], [4.0, 8.0])
+        spreadsheetEvaluator.setCell("A2", "B1 C1 +")
+        self.assertIsNone(spreadsheetEvaluator.topoOrder)
+        spreadsheetEvaluator.evaluate()
+        self.assertEqual([spreadsheetEvaluator.getValue(cellId) for cellId in (3, 4)], [8.0, 16.0])
+
     def testErrorCases(self):
         for test in errorTests:
             with self.subTest(test=test["test"]):
@@ -95,4 +639,9 @@ class SpreadsheetEvaluatorTest(unittest.TestCase):
                 errorOutput = result.stdout + result.stderr
                 self.assertIn(test["error"], errorOutput)
 
+                # The sheet is still written out, with an error value in place of the failing cell
+                with open(outputFile.name, "r") as f:
+                    output = f.read()
+                self.assertTrue(output.startswith("#"))
+
 if __name__ == "__main__": unittest.main()
\ No newline at end of file